@@ -0,0 +1,108 @@
+"""
+Micro-benchmark of attachment url extraction from OS2Forms form data.
+
+Compares the configured extractors on synthetic submissions of increasing
+size for every form type in FORM_TYPE_ATTACHMENT_KEYS.
+
+Run from the repository root with:
+    python -m benchmarks.bench_form_data_extraction
+"""
+
+import json
+import sys
+import timeit
+
+from processes.subprocesses.form_data_handler import (
+    EXTRACTORS,
+    FORM_TYPE_ATTACHMENT_KEYS,
+    TARGETED_MIN_SIZE,
+    orjson,
+)
+
+PAYLOAD_SIZES = (1_000, 100_000, 1_000_000, 10_000_000)
+
+# Form data every extractor must reject with the same error as json.loads,
+# padded where needed so the targeted extractor does not parse it whole.
+INVALID_FORM_DATA = {
+    "NULL form_data": None,
+    "attachments outside data": json.dumps(
+        {
+            "data": {
+                "description": "x" * TARGETED_MIN_SIZE,
+                "x": {"attachments": {"re": {"url": "WRONG"}}},
+            }
+        }
+    ),
+}
+
+
+def build_form_data(form_type: str, size: int) -> str:
+    """Build a submission of roughly `size` bytes with the attachment last."""
+    attachment_key = FORM_TYPE_ATTACHMENT_KEYS[form_type]
+    submission = {
+        "data": {
+            "webform": {"id": form_type},
+            "description": "x" * size,
+            "children": [
+                {"name": f"child {i}", "cpr": "0000000000"} for i in range(10)
+            ],
+            "attachments": {
+                attachment_key: {
+                    "name": "respekt-for-graenser.pdf",
+                    "url": f"https://selvbetjening.aarhuskommune.dk/{form_type}.pdf",
+                }
+            },
+        },
+        "entity": {"uuid": [{"value": "00000000-0000-0000-0000-000000000000"}]},
+    }
+    return json.dumps(submission)
+
+
+def check_invalid_form_data(extractors: dict) -> None:
+    """Assert that every extractor fails on invalid form data like json.loads."""
+    for description, form_data in INVALID_FORM_DATA.items():
+        try:
+            json.loads(form_data)["data"]["attachments"]["re"]["url"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            expected = type(e)
+        for name, extractor in extractors.items():
+            try:
+                extractor(form_data, "re")
+            except expected:
+                continue
+            raise AssertionError(f"{name} did not raise {expected} on {description}")
+
+
+def main() -> None:
+    """Run the benchmark and print a table of mean time per extraction."""
+    extractors = {
+        name: extractor
+        for name, extractor in EXTRACTORS.items()
+        if name != "orjson" or orjson is not None
+    }
+    check_invalid_form_data(extractors)
+
+    print(f"{'form type':<32}{'size':>12}" + "".join(f"{n:>12}" for n in extractors))
+    for form_type, attachment_key in FORM_TYPE_ATTACHMENT_KEYS.items():
+        for size in PAYLOAD_SIZES:
+            form_data = build_form_data(form_type, size)
+            expected = json.loads(form_data)["data"]["attachments"][attachment_key]
+            number = max(1, 2_000_000 // size)
+
+            timings = []
+            for extractor in extractors.values():
+                assert extractor(form_data, attachment_key) == expected["url"]
+                seconds = timeit.timeit(
+                    lambda e=extractor, d=form_data, k=attachment_key: e(d, k),
+                    number=number,
+                )
+                timings.append(f"{seconds / number * 1e6:>10.1f}us")
+
+            print(f"{form_type:<32}{len(form_data):>12}" + "".join(timings))
+
+    if orjson is None:
+        print("orjson is not installed; install the 'fast' extra to compare it.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
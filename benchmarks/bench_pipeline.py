@@ -0,0 +1,244 @@
+"""
+End-to-end benchmark of the queue and process stages against local fakes.
+
+Every scenario runs for each size in a fresh subprocess with its own state
+directory, SQLite journalizing database, HTTP server standing in for ATS and
+OS2Forms and SMTP sink (see benchmarks/fakes.py). The scenarios are:
+
+- populate: populate_queue from the journalizing database into the workqueue.
+- concurrent_add: concurrent_add of ready-made items into the workqueue.
+- process: process_workqueue of a populated workqueue, sending every mail.
+
+Throughput, latency percentiles of the main stage and peak RSS are reported
+per run.
+
+Run from the repository root with:
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --sizes 10 1000 --scenarios process \
+        --workers 4 --latency-ms 5 --json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+
+import main as app
+from benchmarks.fakes import (
+    FakeHTTPServer,
+    FakeWorkqueue,
+    FaultProfile,
+    SMTPSink,
+    create_journalizing_db,
+    install_services,
+    seed_forms,
+    share_engine,
+)
+from helpers import config, metrics
+from processes.queue_handler import concurrent_add
+from processes.subprocesses import engine_handler
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SCENARIOS = ("populate", "concurrent_add", "process")
+SIZES = (10, 1_000, 10_000)
+
+MAIN_STAGE = {
+    "populate": "add_chunk",
+    "concurrent_add": "add_chunk",
+    "process": "process_item",
+}
+
+
+def peak_rss_mb() -> float | None:
+    """Return the peak resident set size of this process in MiB, if known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def install_fakes(args: argparse.Namespace) -> tuple[FakeHTTPServer, SMTPSink]:
+    """Start the fake services and point the process at them."""
+    faults = FaultProfile(latency=args.latency_ms / 1000)
+    http = FakeHTTPServer(args.attachment_kb * 1024, faults=faults).start()
+    smtp = SMTPSink(faults=faults).start()
+    install_services(http, smtp)
+    return http, smtp
+
+
+def count_forms(status: str) -> int:
+    """Return the number of forms with a status in the journalizing database."""
+    with engine_handler.get_engine().connect() as connection:
+        return connection.execute(
+            text(
+                "SELECT COUNT(*) FROM [RPA].[journalizing].[Journalizing] "
+                "WHERE status = :status"
+            ),
+            {"status": status},
+        ).scalar_one()
+
+
+def run_child(scenario: str, size: int, args: argparse.Namespace) -> dict:
+    """Run one scenario of one size in this process and return its results."""
+    http, smtp = install_fakes(args)
+    engine = create_journalizing_db(config.STATE_DIR / "journalizing.sqlite3")
+    share_engine(engine)
+
+    workqueue = FakeWorkqueue(latency=args.latency_ms / 1000)
+    http.workqueues[workqueue.id] = workqueue
+    items = seed_forms(engine, size, http.url)
+
+    if scenario == "process":
+        for it in items:
+            workqueue.add_item({"item": it}, it["reference"])
+
+    metrics.reset_metrics()
+    started = time.perf_counter()
+
+    try:
+        if scenario == "populate":
+            asyncio.run(app.populate_queue(workqueue))
+            done = len(workqueue.items)
+        elif scenario == "concurrent_add":
+            asyncio.run(concurrent_add(workqueue, items))
+            done = len(workqueue.items)
+        else:
+            asyncio.run(app.process_workqueue(workqueue, workers=args.workers))
+            done = workqueue.count("completed")
+        elapsed = time.perf_counter() - started
+
+        if scenario == "process" and (
+            smtp.messages != done or count_forms("Manual") != done
+        ):
+            raise RuntimeError(
+                f"{done} items completed but {smtp.messages} mails were sent "
+                f"and {count_forms('Manual')} forms updated"
+            )
+    finally:
+        http.stop()
+        smtp.stop()
+
+    # populate_queue and process_workqueue report and reset their samples.
+    summary = {
+        "populate": metrics.get_report("queue"),
+        "process": metrics.get_report("process"),
+    }.get(scenario) or metrics.get_summary()
+    stage = summary.get(MAIN_STAGE[scenario], {})
+    return {
+        "scenario": scenario,
+        "size": size,
+        "done": done,
+        "seconds": elapsed,
+        "items_per_second": done / elapsed if elapsed else 0.0,
+        "stage": MAIN_STAGE[scenario],
+        "p50": stage.get("p50", 0.0),
+        "p95": stage.get("p95", 0.0),
+        "p99": stage.get("p99", 0.0),
+        "peak_rss_mb": peak_rss_mb(),
+        "mails": smtp.messages,
+        "stages": summary,
+    }
+
+
+def run_isolated(scenario: str, size: int, args: argparse.Namespace) -> dict:
+    """Run one scenario of one size in a subprocess with a fresh state directory."""
+    with tempfile.TemporaryDirectory(prefix="rfg-bench-") as state_dir:
+        command = [
+            sys.executable,
+            "-m",
+            "benchmarks.bench_pipeline",
+            "--child",
+            scenario,
+            str(size),
+            "--workers",
+            str(args.workers),
+            "--latency-ms",
+            str(args.latency_ms),
+            "--attachment-kb",
+            str(args.attachment_kb),
+        ]
+        if args.verbose:
+            command.append("--verbose")
+
+        result = subprocess.run(
+            command,
+            env=dict(os.environ, RFG_STATE_DIR=state_dir),
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0.0,
+        help="latency added to every fake ATS, OS2Forms and SMTP call",
+    )
+    parser.add_argument("--attachment-kb", type=int, default=100)
+    parser.add_argument("--json", help="write all results to this file")
+    parser.add_argument("--verbose", action="store_true", help="log at INFO level")
+    parser.add_argument(
+        "--child", nargs=2, metavar=("SCENARIO", "SIZE"), help=argparse.SUPPRESS
+    )
+    return parser.parse_args()
+
+
+def main() -> int:
+    """Run the benchmark and print a table of the results."""
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr
+    )
+
+    if args.child:
+        scenario, size = args.child
+        print(json.dumps(run_child(scenario, int(size), args)))
+        return 0
+
+    print(
+        f"{'scenario':<16}{'size':>8}{'done':>8}{'seconds':>10}{'items/s':>10}"
+        f"{'stage':>14}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'peak RSS':>10}"
+    )
+    results = []
+    for scenario in args.scenarios:
+        for size in args.sizes:
+            result = run_isolated(scenario, size, args)
+            results.append(result)
+            rss = result["peak_rss_mb"]
+            print(
+                f"{scenario:<16}{size:>8}{result['done']:>8}"
+                f"{result['seconds']:>10.2f}{result['items_per_second']:>10.1f}"
+                f"{result['stage']:>14}{result['p50'] * 1e3:>9.2f}"
+                f"{result['p95'] * 1e3:>9.2f}{result['p99'] * 1e3:>9.2f}"
+                + (f"{rss:>8.1f}MB" if rss is not None else f"{'n/a':>10}"),
+                flush=True,
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
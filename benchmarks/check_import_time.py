@@ -0,0 +1,109 @@
+"""
+Startup import budget check.
+
+Measures the import time of main.py with `python -X importtime` and fails
+when the time spent on top of the automation server client and the RPA core
+framework exceeds the budget, or when a module that should only be imported
+on first use is loaded by the startup or by a --finalize run.
+
+Run from the repository root with:
+    python -m benchmarks.check_import_time
+    python -m benchmarks.check_import_time --budget-ms 100 --runs 10
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+BUDGET_MS = 150
+RUNS = 5
+
+# Imported by main.py regardless of our own code.
+FRAMEWORK = (
+    "automation_server_client",
+    "mbu_rpa_core.exceptions",
+    "mbu_rpa_core.process_states",
+)
+
+# Only imported when the stage using them runs.
+DEFERRED = (
+    "mbu_dev_shared_components",
+    "PIL",
+    "pyodbc",
+    "requests",
+    "smtplib",
+    "sqlalchemy",
+    "urllib3",
+)
+
+MODES = {
+    "startup": "import main",
+    "finalize": "import asyncio, main; asyncio.run(main.finalize(None))",
+}
+
+
+def import_time_ms(statement: str) -> float:
+    """Return the cumulative import time of the top-level imports of a statement."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  ", 1):
+            total += int(cumulative)
+    return total / 1000
+
+
+def loaded_modules(statement: str) -> set[str]:
+    """Return the top-level packages in sys.modules after running a statement."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"{statement}\nimport json, sys\n"
+            "print(json.dumps(sorted({m.split('.')[0] for m in sys.modules})))",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    return set(json.loads(result.stdout.strip().splitlines()[-1]))
+
+
+def main() -> int:
+    """Run the check and return a non-zero exit code when it fails."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=RUNS)
+    args = parser.parse_args()
+
+    framework_statement = "import " + ", ".join(FRAMEWORK)
+    framework_ms = min(import_time_ms(framework_statement) for _ in range(args.runs))
+    startup_ms = min(import_time_ms(MODES["startup"]) for _ in range(args.runs))
+    own_ms = startup_ms - framework_ms
+
+    print(f"import main:        {startup_ms:8.1f} ms")
+    print(f"framework imports:  {framework_ms:8.1f} ms")
+    print(f"own startup:        {own_ms:8.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    failed = own_ms > args.budget_ms
+    framework_modules = loaded_modules(framework_statement)
+    for mode, statement in MODES.items():
+        eager = (loaded_modules(statement) - framework_modules) & set(DEFERRED)
+        if eager:
+            print(f"{mode} imports deferred modules: {', '.join(sorted(eager))}")
+            failed = True
+
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,493 @@
+"""
+Local stand-ins for the services the process talks to.
+
+Used by the benchmarks to run the queue and process stages end-to-end
+without ATS, OS2Forms, the SMTP relay or the journalizing database:
+
+- FakeHTTPServer serves the ATS workqueue item pages and OS2Forms attachments.
+- SMTPSink accepts and discards mail.
+- FakeWorkqueue and FakeWorkItem stand in for the automation server client.
+- create_journalizing_db creates a SQLite copy of the journalizing tables.
+- FakeRPAConnection serves the credentials and constants.
+
+The latency and error rate of each service are set by a FaultProfile.
+"""
+
+import json
+import os
+import random
+import socketserver
+import sqlite3
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+from mbu_dev_shared_components.database import connection as rpa_connection
+from sqlalchemy import Engine, create_engine, event
+
+from helpers import config
+from processes.subprocesses import engine_handler
+from processes.subprocesses.form_data_handler import FORM_TYPE_ATTACHMENT_KEYS
+from processes.subprocesses.priority_handler import assign_priority
+
+API_KEY = "benchmark-api-key"
+DB_CONNECTION_STRING = "Driver={Benchmark};Server=sqlite"
+
+DISTRIBUTIONS = ("constant", "uniform", "exponential")
+
+
+@dataclass
+class FaultProfile:
+    """
+    Latency and error distribution of a fake service.
+
+    Latencies are constant, uniform between 0 and twice `latency`, or
+    exponential with mean `latency`. Every call fails with probability
+    `error_rate`.
+    """
+
+    latency: float = 0.0
+    distribution: str = "constant"
+    error_rate: float = 0.0
+    rng: random.Random = field(default_factory=random.Random, repr=False)
+
+    def delay(self) -> None:
+        """Sleep for one latency sample."""
+        if self.latency <= 0:
+            return
+        if self.distribution == "exponential":
+            time.sleep(self.rng.expovariate(1 / self.latency))
+        elif self.distribution == "uniform":
+            time.sleep(self.rng.uniform(0, 2 * self.latency))
+        else:
+            time.sleep(self.latency)
+
+    def fails(self) -> bool:
+        """Draw whether the current call fails."""
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+
+class FakeWorkItem:
+    """In-memory work item recording the final status set by the process"""
+
+    def __init__(self, data: dict, reference: str):
+        self.data = data
+        self.reference = reference
+        self.status = "new"
+        self.message = ""
+
+    def __enter__(self) -> "FakeWorkItem":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc is not None and self.status == "in progress":
+            self.fail(str(exc))
+        return False
+
+    def complete(self, message: str = "") -> None:
+        self.status, self.message = "completed", message
+
+    def fail(self, message: str = "") -> None:
+        self.status, self.message = "failed", message
+
+    def pending_user(self, message: str = "") -> None:
+        self.status, self.message = "pending user action", message
+
+
+class FakeWorkqueue:
+    """
+    Thread-safe in-memory workqueue.
+
+    Adding and claiming an item each sleep for `latency` seconds to stand in
+    for the ATS round trip.
+    """
+
+    def __init__(self, workqueue_id: int = 1, name: str = "benchmark", latency=0.0):
+        self.id = workqueue_id
+        self.name = name
+        self.latency = latency
+        self.items: list[FakeWorkItem] = []
+        self._new: deque[FakeWorkItem] = deque()
+        self._lock = threading.Lock()
+
+    def add_item(self, data: dict, reference: str) -> FakeWorkItem:
+        """Add an item to the back of the queue."""
+        if self.latency:
+            time.sleep(self.latency)
+        item = FakeWorkItem(data, reference)
+        with self._lock:
+            self.items.append(item)
+            self._new.append(item)
+        return item
+
+    def next_item(self) -> FakeWorkItem | None:
+        """Claim the next new item, if any."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if not self._new:
+                return None
+            item = self._new.popleft()
+        item.status = "in progress"
+        return item
+
+    def __iter__(self) -> Iterator[FakeWorkItem]:
+        while (item := self.next_item()) is not None:
+            yield item
+
+    def page(self, page: int, size: int) -> dict:
+        """Return one page of items as listed by the ATS API."""
+        with self._lock:
+            total = len(self.items)
+            rows = self.items[(page - 1) * size : page * size]
+            return {
+                "items": [{"reference": item.reference} for item in rows],
+                "total": total,
+                "total_pages": -(-total // size),
+            }
+
+    def count(self, status: str) -> int:
+        """Return the number of items with a status."""
+        with self._lock:
+            return sum(item.status == status for item in self.items)
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "FakeHTTPServer"
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Serve workqueue item pages, and an attachment for any other path."""
+        self.server.faults.delay()
+
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts[0] == "workqueues" and parts[2:] == ["items"]:
+            workqueue = self.server.workqueues.get(int(parts[1]))
+            if workqueue is None:
+                self._send(404, b"")
+                return
+            query = parse_qs(url.query)
+            page = workqueue.page(int(query["page"][0]), int(query["size"][0]))
+            self._send(200, json.dumps(page).encode(), "application/json")
+        else:
+            if self.headers.get("api-key") != API_KEY:
+                self._send(401, b"")
+                return
+            if self.server.faults.fails():
+                self._send(503, b"")
+                return
+            self._send(200, self.server.attachment, "application/pdf")
+
+    def _send(self, status: int, body: bytes, content_type: str = "text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    """HTTP server standing in for the ATS API and the OS2Forms attachments"""
+
+    daemon_threads = True
+
+    def __init__(self, attachment_bytes: int, faults: FaultProfile | None = None):
+        super().__init__(("127.0.0.1", 0), _HTTPHandler)
+        self.faults = faults or FaultProfile()
+        self.attachment = b"%PDF-1.4\n" + b"0" * max(attachment_bytes - 9, 0)
+        self.workqueues: dict[int, FakeWorkqueue] = {}
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base url of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeHTTPServer":
+        """Serve in a background thread."""
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    server: "SMTPSink"
+
+    def _reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        """Speak just enough SMTP for smtplib to deliver messages."""
+        self._reply("220 localhost benchmark sink")
+        while line := self.rfile.readline():
+            command = line[:4].decode("ascii", "replace").upper()
+            if command == "EHLO":
+                self._reply("250-localhost\r\n250-8BITMIME\r\n250 SMTPUTF8")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while (data := self.rfile.readline()) not in (b".\r\n", b""):
+                    size += len(data)
+                self.server.faults.delay()
+                if self.server.faults.fails():
+                    self._reply("451 Temporary local problem")
+                    continue
+                self.server.record(size)
+                self._reply("250 OK")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            elif command in ("HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                self._reply("250 OK")
+            else:
+                self._reply("502 Command not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """SMTP server that counts and discards every message"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, faults: FaultProfile | None = None):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.faults = faults or FaultProfile()
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def record(self, size: int) -> None:
+        """Count a delivered message."""
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+
+    def start(self) -> "SMTPSink":
+        """Serve in a background thread."""
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+
+
+class FakeRPAConnection:
+    """Stand-in for RPAConnection serving fixed credentials and constants"""
+
+    constants: dict[str, str] = {}
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        pass
+
+    def __enter__(self) -> "FakeRPAConnection":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def get_credential(self, name: str) -> dict[str, str]:
+        """Return a credential with the benchmark API key as password."""
+        return {"username": name, "decrypted_password": API_KEY}
+
+    def get_constant(self, name: str) -> dict[str, str]:
+        """Return a configured constant."""
+        return {"constant_name": name, "value": self.constants[name]}
+
+
+def install_services(http: FakeHTTPServer, smtp: SMTPSink) -> None:
+    """Point the process at running fake services and serve fixed constants."""
+    os.environ["ATS_URL"] = http.url
+    os.environ["ATS_TOKEN"] = "benchmark"
+    os.environ["DBCONNECTIONSTRINGPROD"] = DB_CONNECTION_STRING
+
+    FakeRPAConnection.constants = {
+        "rfg_email": "modtager@example.com",
+        "E-mail": "afsender@example.com",
+        "Error Email": "fejl@example.com",
+        "Email Friend": "afsender@example.com",
+        "smtp_adm_server": "127.0.0.1",
+        "smtp_server": "127.0.0.1",
+        "smtp_port": str(smtp.server_address[1]),
+    }
+    rpa_connection.RPAConnection = FakeRPAConnection
+    config.SMTP_STARTTLS = False
+
+
+class _PinnedEngines(dict):
+    """Engine registry whose engines survive dispose_engines"""
+
+    def clear(self) -> None:
+        pass
+
+
+def share_engine(engine: Engine) -> None:
+    """
+    Register an engine as the pooled engine of the journalizing database.
+
+    The engine stays registered when the process disposes its engines, which
+    only closes its pooled connections.
+    """
+    connection_string = engine_handler.get_connection_string(DB_CONNECTION_STRING)
+    engine_handler._engines = _PinnedEngines({connection_string: engine})  # noqa: SLF001
+
+
+def inject_db_faults(engine: Engine, faults: FaultProfile) -> None:
+    """Delay every statement on an engine and fail it at the profile's error rate."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def delay_or_fail(*_args) -> None:
+        faults.delay()
+        if faults.fails():
+            raise sqlite3.OperationalError("injected database failure")
+
+
+def _dateadd(unit: str, number: int, value: str) -> str:
+    return (
+        datetime.fromisoformat(value) + timedelta(**{f"{unit.lower()}s": number})
+    ).isoformat()
+
+
+def create_journalizing_db(path: Path) -> Engine:
+    """
+    Create a SQLite database with the journalizing table and view.
+
+    The T-SQL used by the handlers is translated on the fly: the three-part
+    table names lose their database and schema, and DATEADD and GETDATE are
+    provided as functions.
+    """
+    sqlite3.register_adapter(datetime, datetime.isoformat)
+    sqlite3.register_converter("datetime", lambda b: datetime.fromisoformat(b.decode()))
+
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={
+            "check_same_thread": False,
+            "detect_types": sqlite3.PARSE_COLNAMES,
+        },
+    )
+
+    @event.listens_for(engine, "connect")
+    def register_functions(dbapi_connection, _connection_record) -> None:
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.create_function("DATEADD", 3, _dateadd)
+        dbapi_connection.create_function(
+            "GETDATE",
+            0,
+            lambda: datetime.now().isoformat(),  # noqa: DTZ005
+        )
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def translate(_conn, _cursor, statement, parameters, _context, _executemany):
+        statement = statement.replace("[RPA].[journalizing].", "")
+        if "GETDATE()" in statement:
+            statement = (
+                statement.replace("DATEADD(MINUTE,", "DATEADD('minute',")
+                + ' AS "cutoff [datetime]"'
+            )
+        return statement, parameters
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            """
+            CREATE TABLE Journalizing (
+                form_id TEXT PRIMARY KEY,
+                form_type TEXT NOT NULL,
+                form_data TEXT NOT NULL,
+                status TEXT NOT NULL,
+                form_submitted_date TEXT NOT NULL,
+                documented_date TEXT
+            )
+            """
+        )
+        connection.exec_driver_sql(
+            "CREATE VIEW view_Journalizing AS SELECT * FROM Journalizing"
+        )
+
+    return engine
+
+
+def seed_forms(engine: Engine, count: int, attachment_base_url: str) -> list[dict]:
+    """
+    Insert `count` failed forms and return them as workqueue items.
+
+    Every other form was submitted two days earlier, so the items fall in
+    both the recent and the older priority class.
+
+    Args:
+        engine (Engine): Engine of a database made by create_journalizing_db.
+        count (int): Number of forms to insert.
+        attachment_base_url (str): Base url the attachment urls point to.
+
+    Returns:
+        list[dict]: The queue item each form turns into.
+    """
+    submitted = datetime.now() - timedelta(hours=2)  # noqa: DTZ005
+    rows = []
+    items = []
+    form_types = list(FORM_TYPE_ATTACHMENT_KEYS)
+    for i in range(count):
+        form_id = f"bench-{i:07d}"
+        form_type = form_types[i % len(form_types)]
+        attachment_url = f"{attachment_base_url}/attachments/{form_id}.pdf"
+        form_submitted = submitted - timedelta(days=2 * (i % 2), seconds=-i)
+        form_data = {
+            "data": {
+                "webform": {"id": form_type},
+                "children": [{"name": f"child {n}"} for n in range(3)],
+                "attachments": {
+                    FORM_TYPE_ATTACHMENT_KEYS[form_type]: {
+                        "name": "document.pdf",
+                        "url": attachment_url,
+                    },
+                },
+            },
+        }
+        rows.append(
+            (
+                form_id,
+                form_type,
+                json.dumps(form_data),
+                "Failed",
+                form_submitted.isoformat(),
+            )
+        )
+        items.append(
+            {
+                "reference": form_id,
+                "data": {
+                    "attachment_url": attachment_url,
+                    "priority": assign_priority(form_type, form_submitted),
+                    "queued_at": datetime.now(UTC).isoformat(),
+                },
+            }
+        )
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO Journalizing "
+            "(form_id, form_type, form_data, status, form_submitted_date) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    return items
@@ -0,0 +1,229 @@
+"""
+Replay recorded work items through process_workqueue against local fakes.
+
+Reads a JSONL file with one work item per line, in the shape concurrent_add
+adds to the workqueue:
+
+    {"item": {"reference": "...", "data": {"attachment_url": "..."}}}
+
+and processes them with the real processing path. OS2Forms, the SMTP relay
+and the journalizing database are replaced by the fakes in benchmarks/fakes.py,
+each with its own latency and error distribution. Attachment urls keep their
+path but point at the fake OS2Forms server. The run happens in a subprocess
+with a fresh state directory, so the send ledger and attachment cache start
+empty and production state is never touched.
+
+Run from the repository root with:
+    python main.py --replay items.jsonl --workers 4
+    python -m benchmarks.replay --replay items.jsonl --workers 8 \
+        --os2forms-latency-ms 80 --smtp-latency-ms 40 --distribution exponential \
+        --smtp-error-rate 0.01 --max-errors 1000 --seed 1 --json replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+import main as app
+from benchmarks.bench_pipeline import peak_rss_mb
+from benchmarks.fakes import (
+    DISTRIBUTIONS,
+    FakeHTTPServer,
+    FakeWorkqueue,
+    FaultProfile,
+    SMTPSink,
+    create_journalizing_db,
+    inject_db_faults,
+    install_services,
+    share_engine,
+)
+from helpers import config, metrics
+
+BACKENDS = ("os2forms", "smtp", "db")
+
+
+def load_items(path: Path, base_url: str) -> list[dict]:
+    """
+    Read recorded work items, pointing their attachment urls at the fake server.
+
+    Args:
+        path (Path): JSONL file with one `{"item": {...}}` work item per line.
+        base_url (str): Base url of the fake OS2Forms server.
+
+    Returns:
+        list[dict]: The work items.
+    """
+    base = urlsplit(base_url)
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            data = item["item"].setdefault("data", {})
+            url = urlsplit(data.get("attachment_url", ""))
+            data["attachment_url"] = urlunsplit(
+                (base.scheme, base.netloc, url.path, url.query, "")
+            )
+            items.append(item)
+    return items
+
+
+def fault_profiles(args: argparse.Namespace) -> dict[str, FaultProfile]:
+    """Build the latency and error distribution of every fake backend."""
+    return {
+        backend: FaultProfile(
+            latency=getattr(args, f"{backend}_latency_ms") / 1000,
+            distribution=args.distribution,
+            error_rate=getattr(args, f"{backend}_error_rate"),
+            rng=random.Random(f"{args.seed}-{backend}"),
+        )
+        for backend in BACKENDS
+    }
+
+
+def run_child(args: argparse.Namespace) -> dict:
+    """Replay the items in this process and return the results."""
+    faults = fault_profiles(args)
+    http = FakeHTTPServer(args.attachment_kb * 1024, faults=faults["os2forms"]).start()
+    smtp = SMTPSink(faults=faults["smtp"]).start()
+    install_services(http, smtp)
+
+    items = load_items(Path(args.replay), http.url)
+    workqueue = FakeWorkqueue(name="replay", latency=args.workqueue_latency_ms / 1000)
+    for item in items:
+        workqueue.add_item(item, item["item"]["reference"])
+
+    engine = create_journalizing_db(config.STATE_DIR / "journalizing.sqlite3")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT OR IGNORE INTO Journalizing "
+            "(form_id, form_type, form_data, status, form_submitted_date) "
+            "VALUES (?, 'replay', '{}', 'Failed', '')",
+            [(item["item"]["reference"],) for item in items],
+        )
+    inject_db_faults(engine, faults["db"])
+    share_engine(engine)
+
+    if args.max_errors is not None:
+        config.MAX_RETRY = args.max_errors
+
+    metrics.reset_metrics()
+    started = time.perf_counter()
+    try:
+        asyncio.run(app.process_workqueue(workqueue, workers=args.workers))
+        elapsed = time.perf_counter() - started
+    finally:
+        http.stop()
+        smtp.stop()
+
+    completed = workqueue.count("completed")
+    return {
+        "items": len(items),
+        "completed": completed,
+        "failed": workqueue.count("failed"),
+        "pending_user": workqueue.count("pending user action"),
+        "unprocessed": workqueue.count("new"),
+        "seconds": elapsed,
+        "items_per_second": completed / elapsed if elapsed else 0.0,
+        "mails": smtp.messages,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": metrics.get_report("process"),
+    }
+
+
+def run_isolated(argv: list[str]) -> dict:
+    """Replay in a subprocess with a fresh state directory."""
+    with tempfile.TemporaryDirectory(prefix="rfg-replay-") as state_dir:
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.replay", *argv, "--child"],
+            env=dict(os.environ, RFG_STATE_DIR=state_dir),
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_report(result: dict) -> None:
+    """Print the throughput and per-stage latencies of a replay."""
+    rss = result["peak_rss_mb"]
+    print(
+        f"{result['items']} items in {result['seconds']:.2f}s: "
+        f"{result['completed']} completed ({result['items_per_second']:.1f}/s), "
+        f"{result['failed']} failed, {result['pending_user']} pending user, "
+        f"{result['unprocessed']} unprocessed, {result['mails']} mails, "
+        + (f"peak RSS {rss:.1f}MB" if rss is not None else "peak RSS n/a")
+    )
+    print(
+        f"{'stage':<24}{'count':>8}{'errors':>8}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    for stage, stats in result["stages"].items():
+        print(
+            f"{stage:<24}{stats['count']:>8.0f}{stats['errors']:>8.0f}"
+            f"{stats['p50'] * 1e3:>10.2f}{stats['p95'] * 1e3:>10.2f}"
+            f"{stats['p99'] * 1e3:>10.2f}"
+        )
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """Parse the replay options, ignoring options meant for main.py."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--replay", required=True, metavar="FILE")
+    parser.add_argument("--workers", type=int, default=config.WORKERS)
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="constant")
+    for backend in BACKENDS:
+        parser.add_argument(f"--{backend}-latency-ms", type=float, default=0.0)
+        parser.add_argument(
+            f"--{backend}-error-rate",
+            type=float,
+            default=0.0,
+            help=f"probability that a call to the fake {backend} fails",
+        )
+    parser.add_argument("--workqueue-latency-ms", type=float, default=0.0)
+    parser.add_argument("--attachment-kb", type=int, default=100)
+    parser.add_argument(
+        "--max-errors", type=int, help="error budget, defaults to MAX_RETRY"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="log at INFO level")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the replay and print its report."""
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr
+    )
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return 0
+
+    result = run_isolated([arg for arg in argv if arg != "--child"])
+    print_report(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
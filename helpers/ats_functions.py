@@ -2,17 +2,27 @@
 
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from typing import TYPE_CHECKING
 
-import requests
 from automation_server_client import WorkItem, Workqueue
 from dotenv import load_dotenv
 
+from helpers import config
+from helpers.metrics import timed_function
 
-def get_workqueue_items(workqueue: Workqueue):
-    """
-    Retrieve items from the specified workqueue.
-    If the queue is empty, return an empty list.
-    """
+if TYPE_CHECKING:
+    import requests
+
+_session: "requests.Session | None" = None
+_session_lock = threading.Lock()
+
+
+@cache
+def get_ats_settings() -> tuple[str, str]:
+    """Return the ATS url and token, loading the environment once."""
     load_dotenv()
 
     url = os.getenv("ATS_URL")
@@ -21,30 +31,141 @@ def get_workqueue_items(workqueue: Workqueue):
     if not url or not token:
         raise OSError("ATS_URL or ATS_TOKEN is not set in the environment")
 
-    headers = {"Authorization": f"Bearer {token}"}
-
-    workqueue_items = set()
-    page = 1
-    size = 200  # max allowed
+    return url, token
+
+
+def get_ats_session() -> "requests.Session":
+    """Return a shared keep-alive session for the ATS API with retries on 429/5xx."""
+    global _session  # noqa: PLW0603
+
+    with _session_lock:
+        if _session is None:
+            import requests  # noqa: PLC0415
+            from requests.adapters import HTTPAdapter  # noqa: PLC0415
+            from urllib3.util.retry import Retry  # noqa: PLC0415
+
+            _, token = get_ats_settings()
+            retry = Retry(
+                total=config.ATS_MAX_RETRIES,
+                backoff_factor=config.ATS_RETRY_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                respect_retry_after_header=True,
+            )
+            adapter = HTTPAdapter(
+                pool_maxsize=config.ATS_PAGE_WORKERS, max_retries=retry
+            )
+            _session = requests.Session()
+            _session.headers["Authorization"] = f"Bearer {token}"
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def close_ats_session() -> None:
+    """Close the shared ATS session."""
+    global _session  # noqa: PLW0603
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+@timed_function("get_workqueue_page")
+def _get_items_page(
+    workqueue_id: int, page: int, size: int, reference_only: bool
+) -> dict:
+    """Fetch one page of workqueue items."""
+    url, _ = get_ats_settings()
+    params = {"page": page, "size": size}
+    if reference_only:
+        params["fields"] = "reference"
+
+    response = get_ats_session().get(
+        f"{url}/workqueues/{workqueue_id}/items", params=params, timeout=60
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def _get_page_count(page_json: dict, size: int) -> int | None:
+    """Return the number of pages if the response reports it."""
+    if page_json.get("total_pages") is not None:
+        return int(page_json["total_pages"])
+    if page_json.get("pages") is not None:
+        return int(page_json["pages"])
+    if page_json.get("total") is not None:
+        return -(-int(page_json["total"]) // size)
+    return None
+
+
+@timed_function("get_workqueue_items")
+def get_workqueue_pages(
+    workqueue: Workqueue,
+    start_page: int = 1,
+    reference_only: bool = config.ATS_REFERENCE_ONLY,
+) -> list[list[str | None]]:
+    """
+    Retrieve the references of the workqueue items page by page.
 
-    while True:
-        full_url = f"{url}/workqueues/{workqueue.id}/items?page={page}&size={size}"
-        response = requests.get(full_url, headers=headers, timeout=60)
-        response.raise_for_status()
+    When the first requested page reports the total number of items, the
+    remaining pages are fetched concurrently. Otherwise pages are fetched one
+    at a time until an empty page is returned.
 
-        res_json = response.json().get("items", [])
+    Args:
+        workqueue (Workqueue): The workqueue to list.
+        start_page (int): The first page to fetch.
+        reference_only (bool): Whether to ask the API for the reference only.
 
-        if not res_json:
-            break
+    Returns:
+        list[list[str | None]]: The references of each page from start_page,
+            in order, with None for items without a reference.
+    """
+    size = config.ATS_PAGE_SIZE
+
+    def get_references(page: int) -> tuple[list[str | None], dict]:
+        page_json = _get_items_page(workqueue.id, page, size, reference_only)
+        rows = page_json.get("items", [])
+        return [row.get("reference") or None for row in rows], page_json
+
+    references, first_page = get_references(start_page)
+    if not references:
+        return []
+
+    pages = [references]
+    page_count = _get_page_count(first_page, size)
+
+    if page_count is not None:
+        with ThreadPoolExecutor(max_workers=config.ATS_PAGE_WORKERS) as pool:
+            pages.extend(
+                references
+                for references, _ in pool.map(
+                    get_references, range(start_page + 1, page_count + 1)
+                )
+            )
+        return pages
+
+    page = start_page + 1
+    while references := get_references(page)[0]:
+        pages.append(references)
+        page += 1
 
-        for row in res_json:
-            ref = row.get("reference")
-            if ref:
-                workqueue_items.add(ref)
+    return pages
 
-        page += 1
 
-    return workqueue_items
+def get_workqueue_items(
+    workqueue: Workqueue, reference_only: bool = config.ATS_REFERENCE_ONLY
+):
+    """
+    Retrieve items from the specified workqueue.
+    If the queue is empty, return an empty list.
+    """
+    return {
+        ref
+        for page in get_workqueue_pages(workqueue, reference_only=reference_only)
+        for ref in page
+        if ref
+    }
 
 
 def get_item_info(item: WorkItem):
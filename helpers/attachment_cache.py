@@ -0,0 +1,246 @@
+"""On-disk cache of downloaded attachments, keyed by url"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO
+
+from helpers import config
+
+logger = logging.getLogger(__name__)
+
+_COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class AttachmentCache:
+    """
+    Size-bounded LRU cache of attachment files with checksum verification.
+
+    Each file is stored under the sha256 of its url and indexed in SQLite
+    with its size, sha256, the ETag and Last-Modified validators the server
+    sent and when it was last used. The least recently used files are evicted
+    when the total size exceeds `max_bytes`, and files unused for `max_age`
+    seconds are purged, as attachments hold personal data.
+    """
+
+    def __init__(
+        self,
+        directory: Path = config.ATTACHMENT_CACHE_DIR,
+        max_bytes: int = config.ATTACHMENT_CACHE_MAX_BYTES,
+        max_age: float = config.ATTACHMENT_CACHE_MAX_AGE_HOURS * 3600,
+    ):
+        directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            directory / "index.sqlite3", check_same_thread=False
+        )
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS attachments (
+                url TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS attachments_last_used
+                ON attachments (last_used);
+            """
+        )
+
+    def _path(self, url: str) -> Path:
+        return self.directory / hashlib.sha256(url.encode()).hexdigest()
+
+    def get(self, url: str) -> dict | None:
+        """Return the index entry of a cached attachment, if any and not expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, sha256, etag, last_modified FROM attachments "
+                "WHERE url = ? AND last_used >= ?",
+                (url, time.time() - self.max_age),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "size": row[0],
+            "sha256": row[1],
+            "etag": row[2],
+            "last_modified": row[3],
+        }
+
+    def load(self, url: str) -> BinaryIO | None:
+        """
+        Copy a cached attachment into a temporary file after verifying it.
+
+        Entries whose file is missing or does not match its checksum are
+        dropped.
+
+        Args:
+            url (str): The url of the attachment.
+
+        Returns:
+            BinaryIO | None: The attachment, which the caller must close, or
+                None if it is not cached or failed verification.
+        """
+        entry = self.get(url)
+        if entry is None:
+            return None
+
+        attachment = tempfile.SpooledTemporaryFile(  # noqa: SIM115
+            max_size=config.ATTACHMENT_SPOOL_MAX_BYTES
+        )
+        digest = hashlib.sha256()
+        try:
+            with open(self._path(url), "rb") as f:
+                while chunk := f.read(_COPY_CHUNK_BYTES):
+                    digest.update(chunk)
+                    attachment.write(chunk)
+        except FileNotFoundError:
+            pass
+
+        if digest.hexdigest() != entry["sha256"]:
+            attachment.close()
+            logger.warning("Cached attachment for %s failed verification.", url)
+            self.discard(url)
+            return None
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE attachments SET last_used = ? WHERE url = ?",
+                (time.time(), url),
+            )
+        attachment.seek(0)
+        return attachment
+
+    def store(
+        self,
+        url: str,
+        attachment: BinaryIO,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> None:
+        """Cache a copy of an attachment and evict files beyond the size bound."""
+        size = attachment.seek(0, os.SEEK_END)
+        if size > self.max_bytes:
+            attachment.seek(0)
+            return
+
+        attachment.seek(0)
+        path = self._path(url)
+        tmp_path = path.with_suffix(".tmp")
+        digest = hashlib.sha256()
+        with open(tmp_path, "wb") as f:
+            while chunk := attachment.read(_COPY_CHUNK_BYTES):
+                digest.update(chunk)
+                f.write(chunk)
+        attachment.seek(0)
+
+        with self._lock:
+            os.replace(tmp_path, path)
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO attachments "
+                    "(url, size, sha256, etag, last_modified, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, size, digest.hexdigest(), etag, last_modified, time.time()),
+                )
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop the least recently used files until the cache fits its bound."""
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM attachments"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for url, size in self._conn.execute(
+            "SELECT url, size FROM attachments ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._path(url).unlink(missing_ok=True)
+            with self._conn:
+                self._conn.execute("DELETE FROM attachments WHERE url = ?", (url,))
+            total -= size
+            evicted += 1
+        logger.info("Evicted %d attachments from the cache.", evicted)
+
+    def purge(self) -> None:
+        """Drop the files that have not been used within the maximum age."""
+        with self._lock:
+            urls = [
+                url
+                for (url,) in self._conn.execute(
+                    "SELECT url FROM attachments WHERE last_used < ?",
+                    (time.time() - self.max_age,),
+                ).fetchall()
+            ]
+            for url in urls:
+                self._path(url).unlink(missing_ok=True)
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM attachments WHERE url = ?", [(url,) for url in urls]
+                )
+        if urls:
+            logger.info("Purged %d expired attachments from the cache.", len(urls))
+
+    def discard(self, url: str) -> None:
+        """Drop a cached attachment, if any."""
+        with self._lock:
+            self._path(url).unlink(missing_ok=True)
+            with self._conn:
+                self._conn.execute("DELETE FROM attachments WHERE url = ?", (url,))
+
+    def close(self) -> None:
+        """Close the cache index."""
+        with self._lock:
+            self._conn.close()
+
+
+_cache: AttachmentCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_attachment_cache() -> AttachmentCache | None:
+    """Return the shared attachment cache, opening and purging it on first use."""
+    global _cache  # noqa: PLW0603
+
+    if config.ATTACHMENT_CACHE_MAX_BYTES <= 0:
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = AttachmentCache()
+            _cache.purge()
+        return _cache
+
+
+def close_attachment_cache() -> None:
+    """Purge expired attachments and close the shared attachment cache."""
+    global _cache  # noqa: PLW0603
+
+    with _cache_lock:
+        if _cache is not None:
+            _cache.purge()
+            _cache.close()
+            _cache = None
+
+
+def discard_cached_attachment(url: str) -> None:
+    """Drop an attachment from the shared cache once it is no longer needed."""
+    cache = get_attachment_cache()
+    if cache is not None:
+        cache.discard(url)
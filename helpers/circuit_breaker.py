@@ -0,0 +1,239 @@
+"""Per-dependency circuit breakers for the calls made while processing items"""
+
+import functools
+import logging
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+from helpers import config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# HTTP client errors blame the request, except timeouts and rate limiting.
+_CLIENT_ERROR_STATUSES = range(400, 500)
+_RETRYABLE_CLIENT_STATUSES = (408, 429)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is refused or a probe fails because a circuit is open"""
+
+    def __init__(self, dependency: str, retry_after: float):
+        super().__init__(
+            f"Circuit for {dependency} is open, retrying in {retry_after:.0f}s"
+        )
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+def is_dependency_failure(error: Exception) -> bool:
+    """Whether an error counts against the dependency rather than the item."""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None:
+        return True
+    return status not in _CLIENT_ERROR_STATUSES or status in _RETRYABLE_CLIENT_STATUSES
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker for one dependency.
+
+    The circuit opens after `failure_threshold` consecutive failures and
+    refuses calls for `reset_timeout` seconds. It then lets one probe call
+    through: a success closes the circuit, a failure opens it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = config.CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = config.CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._outage_started: float | None = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _retry_after(self) -> float:
+        if self.state == OPEN:
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        if self.state == HALF_OPEN and self._probe_in_flight:
+            return self.reset_timeout
+        return 0.0
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit accepts a call, 0 if it does now."""
+        with self._lock:
+            return self._retry_after()
+
+    def outage(self) -> float:
+        """Seconds since the circuit first opened, 0 while it is closed."""
+        with self._lock:
+            if self._outage_started is None:
+                return 0.0
+            return time.monotonic() - self._outage_started
+
+    def before_call(self) -> None:
+        """Let a call through or raise CircuitOpenError."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+
+            if (
+                self.state == OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout
+            ):
+                self.state = HALF_OPEN
+                logger.info("Circuit for %s is half-open, probing.", self.name)
+
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+
+            raise CircuitOpenError(self.name, self._retry_after())
+
+    def record_success(self) -> None:
+        """Close the circuit after a successful call."""
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(
+                    "Circuit for %s closed after %.0fs.",
+                    self.name,
+                    time.monotonic() - (self._outage_started or 0.0),
+                )
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+            self._outage_started = None
+
+    def record_failure(self) -> bool:
+        """
+        Count a failed call and open the circuit if needed.
+
+        Returns:
+            bool: Whether the failed call was a probe of a half-open circuit.
+        """
+        with self._lock:
+            was_probe = self.state == HALF_OPEN
+            self.failures += 1
+            if was_probe or self.failures >= self.failure_threshold:
+                if self.state == CLOSED:
+                    self._outage_started = time.monotonic()
+                    logger.error(
+                        "Circuit for %s opened after %d consecutive failures.",
+                        self.name,
+                        self.failures,
+                    )
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+            return was_probe
+
+    def call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Call a function through the circuit.
+
+        Raises:
+            CircuitOpenError: If the circuit is open or the call was a failed probe.
+        """
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_dependency_failure(e):
+                self.record_success()
+            elif self.record_failure():
+                raise CircuitOpenError(self.name, self.reset_timeout) from e
+            raise
+        self.record_success()
+        return result
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_health_checks: dict[str, Callable[[], None]] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Return the shared breaker for a dependency, creating it on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def circuit_breaker(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator calling a function through the breaker of a dependency."""
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            return get_breaker(name).call(func, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def health_check(name: str) -> Callable[[Callable[[], None]], Callable[[], None]]:
+    """
+    Decorator registering a cheap call that probes a dependency.
+
+    While the circuit of the dependency is open, probe_open_circuits calls it
+    as the probe instead of letting the next work item through.
+    """
+
+    def decorator(func: Callable[[], None]) -> Callable[[], None]:
+        _health_checks[name] = func
+        return func
+
+    return decorator
+
+
+def probe_open_circuits() -> None:
+    """Probe every open circuit that is due for a probe with its health check."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+
+    for breaker in breakers:
+        check = _health_checks.get(breaker.name)
+        if check is None or breaker.state == CLOSED or breaker.retry_after() > 0:
+            continue
+        try:
+            breaker.call(check)
+        except Exception as e:
+            logger.warning(
+                "Health check of %s failed: %s", breaker.name, e.__cause__ or e
+            )
+
+
+def open_circuits() -> list[str]:
+    """Return the names of the dependencies whose circuit is not closed."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.name for breaker in breakers if breaker.state != CLOSED]
+
+
+def retry_after() -> float:
+    """Seconds until every circuit accepts a call, 0 if all do now."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return max((breaker.retry_after() for breaker in breakers), default=0.0)
+
+
+def longest_outage() -> float:
+    """Seconds the longest current outage has lasted, 0 if all circuits are closed."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return max((breaker.outage() for breaker in breakers), default=0.0)
@@ -1,6 +1,11 @@
 """Module for general configurations of the process"""
 
+import os
+import socket
+from pathlib import Path
+
 MAX_RETRY = 10
+WORKERS = 1  # items processed concurrently, overridden by --workers N
 
 # ----------------------
 # Queue population settings
@@ -8,3 +13,143 @@ MAX_RETRY = 10
 MAX_CONCURRENCY = 100  # tune based on backend capacity
 MAX_RETRIES = 3  # transient failure retries per item
 RETRY_BASE_DELAY = 0.5  # seconds (exponential backoff)
+FORM_DATA_PARSER = "auto"  # "auto", "targeted", "orjson" or "json"
+ADD_CHUNK_SIZE = 25  # items added in turn by one worker thread
+ADD_INITIAL_CONCURRENCY = 8  # chunks in flight at start, adapts up to MAX_CONCURRENCY
+ADD_MIN_CONCURRENCY = 1
+ADD_LATENCY_TARGET = 2.0  # seconds per request before concurrency is reduced
+ADD_BACKOFF_FACTOR = 0.5  # multiplier applied to the limit on errors or slowness
+QUEUE_STREAM_BUFFER = 500  # items buffered between the DB reader and concurrent_add
+
+# ----------------------
+# Credential/constant cache settings
+# ----------------------
+CACHE_TTL_SECONDS = 3600  # cached credentials/constants expire after this
+PRELOAD_CREDENTIALS = ("os2_api",)
+PRELOAD_CONSTANTS = (
+    "rfg_email",
+    "E-mail",
+    "smtp_adm_server",
+    "smtp_port",
+    "Error Email",
+    "Email Friend",
+    "smtp_server",
+)
+
+# ----------------------
+# Database connection pool settings
+# ----------------------
+DB_POOL_SIZE = 5  # persistent connections kept per engine
+DB_MAX_OVERFLOW = 5  # extra connections allowed under load
+DB_POOL_RECYCLE = 1800  # seconds before a pooled connection is recycled
+DB_POOL_PRE_PING = True  # test connections on checkout
+
+# ----------------------
+# Form status write-behind settings
+# ----------------------
+STATUS_BATCH_SIZE = 50  # buffered status updates before a flush
+
+# ----------------------
+# SMTP session settings
+# ----------------------
+SMTP_STARTTLS = True  # disable only for local test SMTP sinks
+SMTP_TIMEOUT = 60  # seconds
+SMTP_MAX_MESSAGES_PER_SESSION = 50  # reconnect after this many messages
+
+# ----------------------
+# Attachment streaming settings
+# ----------------------
+ATTACHMENT_DOWNLOAD_TIMEOUT = 60  # seconds
+ATTACHMENT_SPOOL_MAX_BYTES = 5 * 1024 * 1024  # larger attachments are spooled to disk
+ATTACHMENT_CHUNK_BYTES = 57 * 1024  # download and base64 encoding chunk size
+
+# ----------------------
+# Error email settings
+# ----------------------
+SCREENSHOT_FORMAT = "JPEG"  # "JPEG", "WEBP" or "PNG"
+SCREENSHOT_QUALITY = 70  # JPEG/WebP quality, ignored for PNG
+SCREENSHOT_MAX_WIDTH = 1920  # wider captures are downscaled, 0 keeps the full size
+SCREENSHOT_MAX_BYTES = 1024 * 1024  # captures are downscaled further to fit
+ERROR_EMAIL_TIMEOUT = 120  # seconds to wait for pending error emails at the end
+ERROR_EMAIL_WINDOW = 600  # seconds between error digests
+ERROR_DIGEST_MAX_ENTRIES = 20  # distinct errors listed in one digest
+
+# ----------------------
+# Circuit breaker settings
+# ----------------------
+CIRCUIT_FAILURE_THRESHOLD = 3  # consecutive failures that open a dependency's circuit
+CIRCUIT_RESET_TIMEOUT = 60  # seconds an open circuit waits before a probe call
+CIRCUIT_MAX_OUTAGE = 15 * 60  # seconds a circuit may stay open before the run stops
+
+# ----------------------
+# Attachment prefetch settings
+# ----------------------
+PREFETCH_DEPTH = 2  # items claimed ahead by a single worker, 0 disables it
+PREFETCH_MAX_BYTES = 100 * 1024 * 1024  # memory budget for prefetched attachments
+
+# ----------------------
+# Priority settings
+# ----------------------
+FORM_TYPE_PRIORITIES = {  # higher is processed first
+    "respekt_for_graenser": 1,
+    "respekt_for_graenser_privat": 1,
+    "indmeld_kraenkelser_af_boern": 1,
+}
+PRIORITY_DEFAULT = 1  # priority of unlisted form types and untagged items
+PRIORITY_RECENT_HOURS = 24  # forms submitted this recently are boosted
+PRIORITY_RECENT_BOOST = 1  # priority levels added to recent forms
+
+# ----------------------
+# Local state settings
+# ----------------------
+STATE_DIR = Path(os.getenv("RFG_STATE_DIR", ".state"))
+
+# ----------------------
+# Form discovery settings
+# ----------------------
+FORMS_INCREMENTAL_DISCOVERY = True  # scan only forms newer than the watermark
+FORMS_FULL_RECONCILE_HOURS = 24  # full scan of the view at least this often
+FORMS_MIN_AGE_MINUTES = 30  # forms younger than this are still being journalized
+FORMS_WATERMARK_PATH = STATE_DIR / "forms_watermark.json"
+FORMS_FETCH_BATCH_SIZE = 100  # rows fetched per round trip from the server-side cursor
+
+# ----------------------
+# Automation Server API settings
+# ----------------------
+ATS_PAGE_SIZE = 200  # max allowed by the API
+ATS_PAGE_WORKERS = 8  # concurrent page requests when listing workqueue items
+ATS_MAX_RETRIES = 5  # retries on connection errors, 429 and 5xx responses
+ATS_RETRY_BACKOFF = 0.5  # seconds, doubled for every retry
+ATS_REFERENCE_ONLY = False  # ask the API to return only the reference field
+
+# ----------------------
+# Reference index settings
+# ----------------------
+REFERENCE_INDEX_PATH = STATE_DIR / "reference_index.sqlite3"
+
+# ----------------------
+# Send ledger settings
+# ----------------------
+SEND_LEDGER_PATH = STATE_DIR / "send_ledger.sqlite3"
+SEND_LEDGER_RETENTION_DAYS = 90  # entries older than this are pruned
+
+# ----------------------
+# Multi-node lease settings
+# ----------------------
+LEASES_ENABLED = False  # claim forms in the FormLeases table, see sql/form_leases.sql
+LEASE_TTL_SECONDS = 600  # leases of a crashed node can be claimed after this
+LEASE_BATCH_SIZE = 100  # forms claimed per claim when populating, at most 1000
+NODE_ID = os.getenv("RFG_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# ----------------------
+# Attachment cache settings
+# ----------------------
+ATTACHMENT_CACHE_DIR = STATE_DIR / "attachment_cache"
+ATTACHMENT_CACHE_MAX_BYTES = 512 * 1024 * 1024  # LRU bound, 0 disables the cache
+ATTACHMENT_CACHE_MAX_AGE_HOURS = 24  # files unused this long are purged
+
+# ----------------------
+# Performance report settings
+# ----------------------
+METRICS_JSON_PATH = os.getenv("RFG_METRICS_JSON")  # JSON dump, one file per run
+METRICS_PROMETHEUS_PATH = os.getenv("RFG_METRICS_PROM")  # textfiles, one per run
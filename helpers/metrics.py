@@ -0,0 +1,212 @@
+"""Lightweight per-stage latency instrumentation and end-of-run reports"""
+
+import functools
+import json
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from helpers import config
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+@dataclass
+class StageStats:
+    """Samples recorded for one stage"""
+
+    durations: list[float] = field(default_factory=list)
+    errors: int = 0
+    bytes: int = 0
+
+    def summary(self) -> dict[str, float]:
+        """Return count, error count, bytes and latency quantiles in seconds."""
+        durations = sorted(self.durations)
+        result: dict[str, float] = {
+            "count": len(durations),
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "sum": sum(durations),
+            "max": durations[-1] if durations else 0.0,
+        }
+        for q in QUANTILES:
+            index = max(0, int(len(durations) * q + 0.5) - 1)
+            result[f"p{int(q * 100)}"] = durations[index] if durations else 0.0
+        return result
+
+
+_stages: dict[str, StageStats] = {}
+_stages_lock = threading.Lock()
+_reports: dict[str, dict[str, dict[str, float]]] = {}
+
+
+def _stats(stage: str) -> StageStats:
+    stats = _stages.get(stage)
+    if stats is None:
+        stats = _stages.setdefault(stage, StageStats())
+    return stats
+
+
+def record(stage: str, duration: float, error: bool = False) -> None:
+    """Record one timed call of a stage."""
+    with _stages_lock:
+        stats = _stats(stage)
+        stats.durations.append(duration)
+        if error:
+            stats.errors += 1
+
+
+def record_bytes(stage: str, num_bytes: int) -> None:
+    """Add to the number of bytes handled by a stage."""
+    with _stages_lock:
+        _stats(stage).bytes += num_bytes
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time the enclosed block as one call of the stage."""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, error=error)
+
+
+def timed_function(stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator timing every call of a function as one call of the stage."""
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with timed(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_summary() -> dict[str, dict[str, float]]:
+    """Return the summary of every stage recorded so far."""
+    with _stages_lock:
+        return {stage: stats.summary() for stage, stats in sorted(_stages.items())}
+
+
+def reset_metrics() -> None:
+    """Drop all recorded samples."""
+    with _stages_lock:
+        _stages.clear()
+
+
+def get_report(run: str) -> dict[str, dict[str, float]]:
+    """Return the summary of the last report of a run, empty if there was none."""
+    with _stages_lock:
+        return _reports.get(run, {})
+
+
+def _to_prometheus(run: str, summary: dict[str, dict[str, float]]) -> str:
+    """Render a summary in the Prometheus text exposition format."""
+    lines = [
+        "# HELP rfg_stage_duration_seconds Latency of each process stage.",
+        "# TYPE rfg_stage_duration_seconds summary",
+    ]
+    for stage, stats in summary.items():
+        labels = f'run="{run}",stage="{stage}"'
+        for q in QUANTILES:
+            lines.append(
+                f'rfg_stage_duration_seconds{{{labels},quantile="{q}"}} '
+                f"{stats[f'p{int(q * 100)}']}"
+            )
+        lines.append(f"rfg_stage_duration_seconds_sum{{{labels}}} {stats['sum']}")
+        lines.append(f"rfg_stage_duration_seconds_count{{{labels}}} {stats['count']}")
+
+    lines += [
+        "# HELP rfg_stage_errors_total Failed calls of each process stage.",
+        "# TYPE rfg_stage_errors_total counter",
+    ]
+    lines += [
+        f'rfg_stage_errors_total{{run="{run}",stage="{stage}"}} {stats["errors"]}'
+        for stage, stats in summary.items()
+    ]
+    lines += [
+        "# HELP rfg_stage_bytes_total Bytes handled by each process stage.",
+        "# TYPE rfg_stage_bytes_total counter",
+    ]
+    lines += [
+        f'rfg_stage_bytes_total{{run="{run}",stage="{stage}"}} {stats["bytes"]}'
+        for stage, stats in summary.items()
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomically(path: Path, content: str) -> None:
+    """Write a file so readers never see a partial report."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(content, encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def _run_path(path: str, run: str) -> Path:
+    """Return the dump path of a run, with the run name before the suffix."""
+    base = Path(path)
+    return base.with_name(f"{base.stem}_{run}{base.suffix}")
+
+
+def report(run: str) -> None:
+    """
+    Log the performance summary of a run, write the configured dumps and reset.
+
+    Every run gets its own dump files, named after the configured paths with
+    the run name added, e.g. metrics_process.prom for metrics.prom. The
+    samples are dropped afterwards so the next run in the same invocation
+    reports only its own stages.
+
+    Args:
+        run (str): Name of the run, e.g. "queue", "process" or "finalize".
+    """
+    with _stages_lock:
+        summary = {stage: stats.summary() for stage, stats in sorted(_stages.items())}
+        _stages.clear()
+        _reports[run] = summary
+
+    logger.info("Performance summary for %s run:", run)
+    for stage, stats in summary.items():
+        logger.info(
+            "  %-28s count=%d errors=%d p50=%.3fs p95=%.3fs p99=%.3fs max=%.3fs bytes=%d",
+            stage,
+            stats["count"],
+            stats["errors"],
+            stats["p50"],
+            stats["p95"],
+            stats["p99"],
+            stats["max"],
+            stats["bytes"],
+        )
+
+    try:
+        if config.METRICS_JSON_PATH:
+            _write_atomically(
+                _run_path(config.METRICS_JSON_PATH, run),
+                json.dumps(
+                    {"run": run, "timestamp": time.time(), "stages": summary}, indent=2
+                ),
+            )
+        if config.METRICS_PROMETHEUS_PATH:
+            _write_atomically(
+                _run_path(config.METRICS_PROMETHEUS_PATH, run),
+                _to_prometheus(run, summary),
+            )
+    except OSError as e:
+        logger.warning("Could not write performance report: %s", e)
@@ -0,0 +1,161 @@
+"""Local on-disk index of references already added to the workqueue"""
+
+import logging
+import sqlite3
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+
+from automation_server_client import Workqueue
+
+from helpers import ats_functions, config
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceIndex:
+    """
+    SQLite backed set of workqueue references used for queue dedup.
+
+    References are added when items are queued and synced from ATS page by
+    page. ATS lists items in insertion order, so only the last partially
+    synced page and the pages after it need to be fetched again.
+    """
+
+    def __init__(self, workqueue: Workqueue, path: Path = config.REFERENCE_INDEX_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.workqueue = workqueue
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS refs (
+                workqueue_id INTEGER NOT NULL,
+                reference TEXT NOT NULL,
+                PRIMARY KEY (workqueue_id, reference)
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                workqueue_id INTEGER PRIMARY KEY,
+                full_pages INTEGER NOT NULL
+            );
+            """
+        )
+
+    def __contains__(self, reference: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM refs WHERE workqueue_id = ? AND reference = ?",
+                (self.workqueue.id, reference),
+            ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM refs WHERE workqueue_id = ?", (self.workqueue.id,)
+            ).fetchone()[0]
+
+    def add(self, reference: str) -> None:
+        """Add one reference to the index."""
+        self.add_many([reference])
+
+    def add_many(self, references: Iterable[str | None]) -> None:
+        """Add references to the index, ignoring empty ones and duplicates."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO refs (workqueue_id, reference) VALUES (?, ?)",
+                ((self.workqueue.id, str(ref)) for ref in references if ref),
+            )
+
+    def _get_full_pages(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT full_pages FROM sync_state WHERE workqueue_id = ?",
+                (self.workqueue.id,),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _set_full_pages(self, full_pages: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (workqueue_id, full_pages) "
+                "VALUES (?, ?)",
+                (self.workqueue.id, full_pages),
+            )
+
+    def sync(self) -> None:
+        """Fetch the ATS pages not yet fully synced and add their references."""
+        full_pages = self._get_full_pages()
+        pages = ats_functions.get_workqueue_pages(
+            self.workqueue, start_page=full_pages + 1
+        )
+
+        for references in pages:
+            self.add_many(references)
+
+        new_full_pages = 0
+        for references in pages:
+            if len(references) < config.ATS_PAGE_SIZE:
+                break
+            new_full_pages += 1
+        self._set_full_pages(full_pages + new_full_pages)
+
+        logger.info(
+            "Synced reference index from page %d (%d pages fetched, %d references).",
+            full_pages + 1,
+            len(pages),
+            len(self),
+        )
+
+    def rebuild(self) -> None:
+        """Drop the index and sync it from the first page."""
+        with self._lock, self._conn:
+            for table in ("refs", "sync_state"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE workqueue_id = ?",
+                    (self.workqueue.id,),
+                )
+        logger.info("Rebuilding reference index...")
+        self.sync()
+
+    def check(self) -> bool:
+        """
+        Compare the index with the full set of references in ATS.
+
+        References missing from the index are added. References only in the
+        index are reported but kept, as they may belong to items that have
+        since been deleted from the workqueue.
+
+        Returns:
+            bool: Whether the index contained every reference in ATS.
+        """
+        with self._lock:
+            indexed = {
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT reference FROM refs WHERE workqueue_id = ?",
+                    (self.workqueue.id,),
+                )
+            }
+        remote = {str(ref) for ref in ats_functions.get_workqueue_items(self.workqueue)}
+
+        missing = remote - indexed
+        extra = indexed - remote
+        logger.info(
+            "Reference index check: %d in ATS, %d indexed, %d missing, %d extra.",
+            len(remote),
+            len(indexed),
+            len(missing),
+            len(extra),
+        )
+
+        if missing:
+            self.add_many(missing)
+
+        return not missing
+
+    def close(self) -> None:
+        """Close the index."""
+        with self._lock:
+            self._conn.close()
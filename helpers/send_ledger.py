@@ -0,0 +1,142 @@
+"""Local durable ledger of the notification emails that have been sent"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO
+
+from helpers import config
+
+logger = logging.getLogger(__name__)
+
+
+class SendLedger:
+    """
+    SQLite backed record of sent emails, keyed by form and attachment url.
+
+    An entry is written as soon as the email for a form has been sent, so a
+    retried item can skip the download and send and only redo the status
+    update that failed. The status updates still owed to the journalizing
+    database are kept alongside until they have been written, so a failed
+    flush is retried by the next run.
+    """
+
+    def __init__(self, path: Path = config.SEND_LEDGER_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=FULL;
+            CREATE TABLE IF NOT EXISTS sent (
+                form_id TEXT NOT NULL,
+                attachment_url TEXT NOT NULL,
+                attachment_sha256 TEXT NOT NULL,
+                sent_at TEXT NOT NULL,
+                PRIMARY KEY (form_id, attachment_url)
+            );
+            CREATE TABLE IF NOT EXISTS pending_status (
+                form_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL
+            );
+            """
+        )
+
+    def get(self, form_id: str, attachment_url: str) -> dict | None:
+        """Return the ledger entry of a sent email, if any."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attachment_sha256, sent_at FROM sent "
+                "WHERE form_id = ? AND attachment_url = ?",
+                (form_id, attachment_url),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"attachment_sha256": row[0], "sent_at": row[1]}
+
+    def record(self, form_id: str, attachment_url: str, attachment: BinaryIO) -> None:
+        """Record that the email with an attachment has been sent for a form."""
+        attachment.seek(0)
+        digest = hashlib.file_digest(attachment, "sha256").hexdigest()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sent "
+                "(form_id, attachment_url, attachment_sha256, sent_at) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    form_id,
+                    attachment_url,
+                    digest,
+                    datetime.now(UTC).isoformat(),
+                ),
+            )
+
+    def queue_status(self, form_id: str, status: str) -> int:
+        """Keep a status update owed for a form and return the number owed."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pending_status (form_id, status) VALUES (?, ?)",
+                (form_id, status),
+            )
+            return self._conn.execute("SELECT COUNT(*) FROM pending_status").fetchone()[
+                0
+            ]
+
+    def pending_statuses(self) -> dict[str, str]:
+        """Return the status updates owed, by form."""
+        with self._lock:
+            return dict(
+                self._conn.execute("SELECT form_id, status FROM pending_status")
+            )
+
+    def clear_statuses(self, statuses: dict[str, str]) -> None:
+        """Forget status updates once written, unless a newer one was queued."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM pending_status WHERE form_id = ? AND status = ?",
+                statuses.items(),
+            )
+
+    def prune(self, retention_days: int = config.SEND_LEDGER_RETENTION_DAYS) -> None:
+        """Drop entries older than the retention period."""
+        cutoff = datetime.now(UTC) - timedelta(days=retention_days)
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM sent WHERE sent_at < ?", (cutoff.isoformat(),)
+            ).rowcount
+        if deleted:
+            logger.info("Pruned %d send ledger entries.", deleted)
+
+    def close(self) -> None:
+        """Close the ledger."""
+        with self._lock:
+            self._conn.close()
+
+
+_ledger: SendLedger | None = None
+_ledger_lock = threading.Lock()
+
+
+def get_send_ledger() -> SendLedger:
+    """Return the shared send ledger, opening and pruning it on first use."""
+    global _ledger  # noqa: PLW0603
+
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = SendLedger()
+            _ledger.prune()
+        return _ledger
+
+
+def close_send_ledger() -> None:
+    """Close the shared send ledger."""
+    global _ledger  # noqa: PLW0603
+
+    with _ledger_lock:
+        if _ledger is not None:
+            _ledger.close()
+            _ledger = None
@@ -5,107 +5,413 @@ This is the main entry point for the process
 import asyncio
 import logging
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO
 
-from automation_server_client import AutomationServer, Workqueue
+from automation_server_client import AutomationServer, WorkItem, Workqueue
 from mbu_rpa_core.exceptions import BusinessError, ProcessError
 from mbu_rpa_core.process_states import CompletedState
 
-from helpers import ats_functions, config
+from helpers import ats_functions, circuit_breaker, config, metrics
+from helpers.attachment_cache import (
+    close_attachment_cache,
+    discard_cached_attachment,
+)
+from helpers.circuit_breaker import CircuitOpenError
+from helpers.reference_index import ReferenceIndex
+from helpers.send_ledger import close_send_ledger
 from processes.application_handler import close, reset, startup
-from processes.error_handling import ErrorContext, handle_error
+from processes.error_handling import (
+    ErrorBudget,
+    ErrorContext,
+    flush_error_emails,
+    handle_error,
+)
 from processes.finalize_process import finalize_process
 from processes.process_item import process_item
-from processes.queue_handler import concurrent_add, retrieve_items_for_queue
+from processes.queue_handler import (
+    concurrent_add,
+    retrieve_items_for_queue,
+    stream_in_thread,
+)
+from processes.subprocesses.credentials_constant_handler import get_cache_stats
+from processes.subprocesses.db_handler import (
+    flush_form_statuses,
+    get_pending_form_ids,
+)
+from processes.subprocesses.forms_handler import commit_forms_watermark
+from processes.subprocesses.lease_handler import (
+    QUEUE_STAGE,
+    LeaseHeldError,
+    finish_form_leases,
+    leased_items,
+)
+from processes.subprocesses.prefetch_handler import (
+    AttachmentPrefetcher,
+    PrefetchedItem,
+)
+from processes.subprocesses.priority_handler import record_queue_wait
+from processes.subprocesses.smtp_handler import set_smtp_pool_size
 
 logger = logging.getLogger(__name__)
 
 
-async def populate_queue(workqueue: Workqueue) -> None:
+def get_int_option(name: str, default: int) -> int:
+    """Read an integer command line option given as `name value`."""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return int(sys.argv[index + 1])
+    return default
+
+
+async def populate_queue(workqueue: Workqueue, rebuild_index: bool = False) -> None:
     """Populate the workqueue with items to be processed."""
     logger.info("Populating workqueue...")
 
-    items_to_queue = retrieve_items_for_queue()
+    reference_index = ReferenceIndex(workqueue)
+    added: list[str] = []
 
-    queue_references = {str(r) for r in ats_functions.get_workqueue_items(workqueue)}
+    def on_added(reference: str) -> None:
+        reference_index.add(reference)
+        added.append(reference)
 
-    new_items: list[dict] = []
-    for item in items_to_queue:
-        reference = str(item.get("reference") or "")
-        if reference and reference in queue_references:
-            logger.info(
-                "Reference: %s already in queue. Item: %s not added",
-                reference,
-                item,
+    try:
+        with metrics.timed("sync_reference_index"):
+            if rebuild_index:
+                await asyncio.to_thread(reference_index.rebuild)
+            else:
+                await asyncio.to_thread(reference_index.sync)
+
+        async def new_items():
+            async for item in stream_in_thread(retrieve_items_for_queue()):
+                reference = str(item.get("reference") or "")
+                if reference and reference in reference_index:
+                    logger.info(
+                        "Reference: %s already in queue. Item: %s not added",
+                        reference,
+                        item,
+                    )
+                else:
+                    yield item
+
+        items = new_items()
+        if config.LEASES_ENABLED:
+            items = leased_items(items, QUEUE_STAGE)
+
+        with metrics.timed("concurrent_add"):
+            failed = await concurrent_add(workqueue, items, on_added=on_added)
+        if failed:
+            logger.warning(
+                "Forms watermark not advanced, %d item(s) could not be added.", failed
             )
         else:
-            new_items.append(item)
+            commit_forms_watermark()
+    finally:
+        await asyncio.to_thread(finish_form_leases, added, QUEUE_STAGE, True)
+        reference_index.close()
+        ats_functions.close_ats_session()
+        metrics.report("queue")
 
-    await concurrent_add(workqueue, new_items)
     logger.info("Finished populating workqueue.")
 
 
-async def process_workqueue(workqueue: Workqueue) -> None:
-    """Process items from the workqueue."""
+async def check_reference_index(workqueue: Workqueue) -> None:
+    """Check the local reference index against the references in ATS."""
+    reference_index = ReferenceIndex(workqueue)
 
-    logger.info("Processing workqueue...")
+    try:
+        consistent = await asyncio.to_thread(reference_index.check)
+    finally:
+        reference_index.close()
+        ats_functions.close_ats_session()
+
+    if not consistent:
+        logger.warning("Reference index was missing references and has been repaired.")
+
+
+def discard_item_attachment(item: WorkItem) -> None:
+    """Drop the cached attachment of an item that will not be retried."""
+    data, _ = ats_functions.get_item_info(item)
+    discard_cached_attachment(data.get("attachment_url", ""))
+
+
+def handle_business_error(
+    item: WorkItem, workqueue: Workqueue, error: BusinessError
+) -> None:
+    """Hand an item over to a user after a business error."""
+    context = ErrorContext(
+        item=item,
+        action=item.pending_user,
+        send_mail=False,
+        process_name=workqueue.name,
+    )
+    handle_error(
+        error=error,
+        log=logger.info,
+        context=context,
+    )
+    discard_item_attachment(item)
+
+
+def handle_process_error(
+    item: WorkItem, workqueue: Workqueue, error: ProcessError, error_budget: ErrorBudget
+) -> None:
+    """Fail an item after a process error and reset the applications."""
+    context = ErrorContext(
+        item=item,
+        action=item.fail,
+        send_mail=True,
+        process_name=workqueue.name,
+    )
+    handle_error(
+        error=error,
+        log=logger.error,
+        context=context,
+    )
+    discard_item_attachment(item)
+    error_budget.record_error()
+    reset()
+
+
+def handle_circuit_open(
+    item: WorkItem, workqueue: Workqueue, error: CircuitOpenError
+) -> None:
+    """
+    Release an item that was not processed because a dependency is down.
+
+    The item is failed and added to the workqueue again under its reference,
+    so it is processed once the dependency is back, later in this run or in
+    the next. An outage does not count against the error budget or reset the
+    applications. Items that cannot be added again are reported in the error
+    emails, as the reference index keeps them from being queued again.
+    """
+    _, reference = ats_functions.get_item_info(item)
+    logger.warning("Releasing item %s to the workqueue: %s", reference, error)
+    item.fail(str(error))
 
-    startup()
+    try:
+        workqueue.add_item(item.data, reference)
+    except Exception as e:
+        context = ErrorContext(
+            send_mail=True,
+            add_screenshot=False,
+            process_name=workqueue.name,
+        )
+        handle_error(
+            error=ProcessError(
+                f"Item {reference} was not processed because {error} "
+                f"and could not be added to the workqueue again: {e}"
+            ),
+            log=logger.error,
+            context=context,
+        )
+
+
+def handle_lease_held(item: WorkItem, error: LeaseHeldError) -> None:
+    """Fail an item whose form another node is processing."""
+    logger.warning(
+        "Item %s not processed: %s", ats_functions.get_item_info(item)[1], error
+    )
+    item.fail(str(error))
+    discard_item_attachment(item)
+
+
+def wait_for_circuits() -> bool:
+    """
+    Wait while the circuit of a dependency is open.
+
+    Open circuits are probed with the health check of their dependency, so
+    no work item is claimed until every dependency answers again.
+
+    Returns:
+        bool: False if a dependency has been down longer than
+            CIRCUIT_MAX_OUTAGE and processing should stop.
+    """
+    circuit_breaker.probe_open_circuits()
+    delay = circuit_breaker.retry_after()
+    if delay > 0:
+        logger.warning(
+            "Circuit open for %s, pausing for %.0fs.",
+            ", ".join(circuit_breaker.open_circuits()),
+            delay,
+        )
+
+    while delay > 0:
+        if circuit_breaker.longest_outage() >= config.CIRCUIT_MAX_OUTAGE:
+            logger.error(
+                "Stopped processing, %s down for more than %ds.",
+                ", ".join(circuit_breaker.open_circuits()),
+                config.CIRCUIT_MAX_OUTAGE,
+            )
+            return False
+        time.sleep(min(delay, 1.0))
+        circuit_breaker.probe_open_circuits()
+        delay = circuit_breaker.retry_after()
+
+    return True
+
+
+def flush_statuses(workqueue: Workqueue) -> None:
+    """
+    Write the queued form statuses, reporting the forms left unwritten.
+
+    Unwritten statuses stay queued in the send ledger and are written by the
+    next run or by finalize.
+    """
+    try:
+        flush_form_statuses()
+    except Exception as e:
+        form_ids = get_pending_form_ids()
+        pe = ProcessError(
+            f"Status of {len(form_ids)} form(s) not written, kept for the next "
+            f"run: {', '.join(form_ids)}. Error: {e}"
+        )
+        context = ErrorContext(
+            send_mail=True,
+            add_screenshot=False,
+            process_name=workqueue.name,
+        )
+        handle_error(error=pe, log=logger.error, context=context)
 
-    error_count = 0
 
-    while error_count < config.MAX_RETRY:
-        for item in workqueue:
+def complete_item(item: WorkItem) -> None:
+    """Mark an item as completed."""
+    completed_state = CompletedState.completed("Process completed without exceptions")
+    item.complete(str(completed_state))
+
+
+def process_work_item(
+    item: WorkItem,
+    workqueue: Workqueue,
+    error_budget: ErrorBudget,
+    attachment: BinaryIO | None = None,
+) -> None:
+    """Process a single work item and handle its errors."""
+    try:
+        with item:
+            data, reference = ats_functions.get_item_info(item)
+            record_queue_wait(item)
+
             try:
-                with item:
-                    data, reference = ats_functions.get_item_info(item)
-
-                    try:
-                        logger.info("Processing item with reference: %s", reference)
-                        process_item(data, reference)
-
-                        completed_state = CompletedState.completed(
-                            "Process completed without exceptions"
-                        )
-                        item.complete(str(completed_state))
-
-                        continue
-
-                    except BusinessError as e:
-                        context = ErrorContext(
-                            item=item,
-                            action=item.pending_user,
-                            send_mail=False,
-                            process_name=workqueue.name,
-                        )
-                        handle_error(
-                            error=e,
-                            log=logger.info,
-                            context=context,
-                        )
-
-                    except Exception as e:
-                        pe = ProcessError(str(e))
-                        raise pe from e
-
-            except ProcessError as e:
-                context = ErrorContext(
-                    item=item,
-                    action=item.fail,
-                    send_mail=True,
-                    process_name=workqueue.name,
-                )
-                handle_error(
-                    error=e,
-                    log=logger.error,
-                    context=context,
+                logger.info("Processing item with reference: %s", reference)
+                process_item(data, reference, attachment=attachment)
+                complete_item(item)
+
+            except BusinessError as e:
+                handle_business_error(item, workqueue, e)
+
+            except CircuitOpenError as e:
+                handle_circuit_open(item, workqueue, e)
+
+            except LeaseHeldError as e:
+                handle_lease_held(item, e)
+
+            except Exception as e:
+                pe = ProcessError(str(e))
+                raise pe from e
+
+    except ProcessError as e:
+        handle_process_error(item, workqueue, e, error_budget)
+
+
+def process_prefetched_items(
+    prefetcher: AttachmentPrefetcher, workqueue: Workqueue, error_budget: ErrorBudget
+) -> None:
+    """Process items from the prefetcher until it is empty or the budget is spent."""
+    while not error_budget.exhausted and wait_for_circuits():
+        entry = next(prefetcher, None)
+        if entry is None:
+            return
+        try:
+            process_work_item(
+                entry.item, workqueue, error_budget, attachment=entry.attachment
+            )
+        finally:
+            prefetcher.release(entry)
+
+
+def process_claimed_items(
+    entries: list[PrefetchedItem], workqueue: Workqueue, error_budget: ErrorBudget
+) -> None:
+    """Process the items claimed ahead but not handed out before stopping."""
+    if entries:
+        logger.info(
+            "Processing %d item(s) claimed ahead before stopping.", len(entries)
+        )
+    for entry in entries:
+        try:
+            process_work_item(
+                entry.item, workqueue, error_budget, attachment=entry.attachment
+            )
+        finally:
+            if entry.attachment is not None:
+                entry.attachment.close()
+
+
+async def process_workqueue_concurrently(
+    prefetcher: AttachmentPrefetcher,
+    workqueue: Workqueue,
+    workers: int,
+    error_budget: ErrorBudget,
+) -> None:
+    """Process items from the workqueue in a bounded pool of worker threads."""
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="worker") as pool:
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    pool, process_prefetched_items, prefetcher, workqueue, error_budget
                 )
-                error_count += 1
-                reset()
+                for _ in range(workers)
+            )
+        )
+
+
+async def process_workqueue(workqueue: Workqueue, workers: int = 1) -> None:
+    """Process items from the workqueue."""
 
-        break
+    logger.info("Processing workqueue with %d worker(s)...", workers)
 
+    startup()
+    set_smtp_pool_size(workers)
+
+    error_budget = ErrorBudget(config.MAX_RETRY)
+    # Concurrent workers overlap downloads themselves, a single prefetch
+    # thread in front of them would only serialize their claims and downloads.
+    prefetcher = AttachmentPrefetcher(
+        iter(workqueue), depth=0 if workers > 1 else config.PREFETCH_DEPTH
+    )
+
+    try:
+        if workers > 1:
+            await process_workqueue_concurrently(
+                prefetcher, workqueue, workers, error_budget
+            )
+        else:
+            process_prefetched_items(prefetcher, workqueue, error_budget)
+
+        process_claimed_items(prefetcher.stop(), workqueue, error_budget)
+    finally:
+        prefetcher.stop()
+
+    if error_budget.exhausted:
+        logger.error("Stopped processing after %d errors.", error_budget.errors)
+
+    cache_stats = get_cache_stats()
+    logger.info(
+        "Credential/constant cache: %d hits, %d misses.",
+        cache_stats["hits"],
+        cache_stats["misses"],
+    )
     logger.info("Finished processing workqueue.")
+    flush_statuses(workqueue)
+    flush_error_emails()
     close()
+    close_send_ledger()
+    close_attachment_cache()
+    metrics.report("process")
 
 
 async def finalize(workqueue: Workqueue) -> None:
@@ -114,7 +420,8 @@ async def finalize(workqueue: Workqueue) -> None:
     logger.info("Finalizing process...")
 
     try:
-        finalize_process()
+        with metrics.timed("finalize_process"):
+            finalize_process()
         logger.info("Finished finalizing process.")
 
     except BusinessError as e:
@@ -130,8 +437,18 @@ async def finalize(workqueue: Workqueue) -> None:
 
         raise pe from e
 
+    finally:
+        flush_error_emails()
+        close_send_ledger()
+        metrics.report("finalize")
+
 
 if __name__ == "__main__":
+    if "--replay" in sys.argv:
+        from benchmarks.replay import main as replay  # noqa: PLC0415
+
+        sys.exit(replay(sys.argv[1:]))
+
     ats_functions.init_logger()
 
     ats = AutomationServer.from_environment()
@@ -139,11 +456,17 @@ if __name__ == "__main__":
     prod_workqueue = ats.workqueue()
     process = ats.process
 
+    if "--check-index" in sys.argv:
+        asyncio.run(check_reference_index(prod_workqueue))
+
     if "--queue" in sys.argv:
-        asyncio.run(populate_queue(prod_workqueue))
+        asyncio.run(
+            populate_queue(prod_workqueue, rebuild_index="--rebuild-index" in sys.argv)
+        )
 
     if "--process" in sys.argv:
-        asyncio.run(process_workqueue(prod_workqueue))
+        workers = get_int_option("--workers", config.WORKERS)
+        asyncio.run(process_workqueue(prod_workqueue, workers=workers))
 
     if "--finalize" in sys.argv:
         asyncio.run(finalize(prod_workqueue))
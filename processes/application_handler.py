@@ -1,23 +1,38 @@
 """Module for handling application startup, and close"""
 
 import logging
+import threading
+
+from processes.subprocesses.credentials_constant_handler import (
+    invalidate_cache,
+    preload,
+)
+from processes.subprocesses.engine_handler import dispose_engines
+from processes.subprocesses.smtp_handler import close_smtp_sessions
 
 logger = logging.getLogger(__name__)
 
+_reset_lock = threading.Lock()
+
 
 def startup():
     """Function for starting applications"""
     logger.info("Starting applications...")
+    preload()
 
 
 def soft_close():
     """Function for closing applications softly"""
     logger.info("Closing applications softly...")
+    dispose_engines()
+    close_smtp_sessions()
 
 
 def hard_close():
     """Function for closing applications hard"""
     logger.info("Closing applications hard...")
+    dispose_engines()
+    close_smtp_sessions()
 
 
 def close():
@@ -30,5 +45,7 @@ def close():
 
 def reset():
     """Function for resetting application"""
-    close()
-    startup()
+    with _reset_lock:
+        close()
+        invalidate_cache()
+        startup()
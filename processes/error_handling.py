@@ -1,32 +1,179 @@
 """Module for handling errors"""
 
-import base64
+import html
 import json
-import smtplib
+import logging
+import re
+import threading
+import time
 from collections.abc import Callable
-from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
 from email.message import EmailMessage
+from email.utils import make_msgid
 from io import BytesIO
+from typing import TYPE_CHECKING
 
-from automation_server_client import WorkItem
-from mbu_dev_shared_components.database.connection import RPAConnection
-from mbu_rpa_core.exceptions import BusinessError, ProcessError
-from PIL import ImageGrab
+from helpers import config
+from processes.subprocesses.credentials_constant_handler import get_constant
+from processes.subprocesses.smtp_handler import send_smtp_message
+
+if TYPE_CHECKING:
+    from automation_server_client import WorkItem
+    from mbu_rpa_core.exceptions import BusinessError, ProcessError
+    from PIL.Image import Image
+
+logger = logging.getLogger(__name__)
+
+MIN_SCREENSHOT_WIDTH = 320
+SCREENSHOT_DOWNSCALE_STEP = 0.75
+
+_email_executor: ThreadPoolExecutor | None = None
+_email_lock = threading.Lock()
+_pending_emails: set[Future] = set()
+_screenshot_executor: ThreadPoolExecutor | None = None
+
+# Ids, counters and addresses that differ between otherwise identical errors.
+_VOLATILE_PATTERN = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|0x[0-9a-f]+|\d+",
+    re.IGNORECASE,
+)
 
 
 @dataclass
 class ErrorContext:
     """Context for error handling"""
 
-    item: WorkItem | None = None
+    item: "WorkItem | None" = None
     action: Callable | None = None
     send_mail: bool = False
     add_screenshot: bool = True
     process_name: str | None = None
 
 
+@dataclass
+class ErrorDigestEntry:
+    """All occurrences of one error fingerprint since the last digest"""
+
+    error_type: str
+    message: str
+    traceback: str
+    count: int = 1
+    first_seen: datetime = field(default_factory=lambda: datetime.now(UTC))
+    last_seen: datetime = field(default_factory=lambda: datetime.now(UTC))
+    screenshot: "Future[tuple[bytes, str] | None] | None" = None
+
+
+def error_fingerprint(error_info: dict) -> tuple[str, str]:
+    """Return the error type and its message with volatile parts masked."""
+    return error_info["type"], _VOLATILE_PATTERN.sub("#", error_info["message"])
+
+
+class ErrorAggregator:
+    """
+    Collects errors and emails them as digests at most once per window.
+
+    Errors are deduplicated by fingerprint. The first error after a quiet
+    window is sent right away, later ones are held until the window has
+    passed and flush is called at the end of a run to send the rest.
+    """
+
+    def __init__(self, window: float = config.ERROR_EMAIL_WINDOW):
+        self.window = window
+        self.errors = 0
+        self.suppressed = 0
+        self.digests = 0
+        self._entries: dict[tuple[str, str], ErrorDigestEntry] = {}
+        self._process_name: str | None = None
+        self._last_sent: float | None = None
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    def add(
+        self, error_info: dict, process_name: str | None, add_screenshot: bool
+    ) -> None:
+        """
+        Record an error and send a digest if none was sent within the window.
+
+        The screen is captured at the first occurrence of a fingerprint, so the
+        screenshot shows the failure rather than the screen at sending time.
+        """
+        key = error_fingerprint(error_info)
+
+        with self._lock:
+            self.errors += 1
+            entry = self._entries.get(key)
+            first_occurrence = entry is None
+            if entry is None:
+                entry = self._entries[key] = ErrorDigestEntry(
+                    error_type=error_info["type"],
+                    message=error_info["message"],
+                    traceback=error_info["traceback"],
+                )
+            else:
+                entry.count += 1
+                entry.last_seen = datetime.now(UTC)
+                self.suppressed += 1
+
+            self._process_name = process_name or self._process_name
+
+            waited = (
+                None if self._last_sent is None else time.monotonic() - self._last_sent
+            )
+            due = waited is None or waited >= self.window
+            if not due and self._timer is None:
+                self._timer = threading.Timer(self.window - waited, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if first_occurrence and add_screenshot:
+            entry.screenshot = _capture_screenshot()
+
+        if due:
+            self.flush()
+
+    def flush(self) -> Future | None:
+        """Send the collected errors as one digest in the background."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if not self._entries:
+                return None
+
+            entries = list(self._entries.values())
+            self._entries.clear()
+            process_name = self._process_name
+            self._last_sent = time.monotonic()
+            self.digests += 1
+
+        return _submit_email(send_error_digest, entries, process_name)
+
+
+class ErrorBudget:
+    """Thread-safe counter of process errors shared by all workers"""
+
+    def __init__(self, max_errors: int):
+        self.max_errors = max_errors
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record_error(self) -> None:
+        """Count one process error."""
+        with self._lock:
+            self.errors += 1
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether the maximum number of errors has been reached."""
+        with self._lock:
+            return self.errors >= self.max_errors
+
+
 def handle_error(
-    error: ProcessError | BusinessError,
+    error: "ProcessError | BusinessError",
     log,
     context: ErrorContext | None = None,
 ) -> None:
@@ -44,7 +191,8 @@ def handle_error(
     """
     if context is None:
         context = ErrorContext()
-    error_json = json.dumps(error.__dictinfo__())
+    error_info = error.__dictinfo__()
+    error_json = json.dumps(error_info)
     log_msg = f"Error: {error}"
     if context.item:
         log_msg = f"{repr(error)} raised for item: {context.item}. " + log_msg
@@ -52,65 +200,132 @@ def handle_error(
             context.action(error_json)
     log(log_msg)
     if context.send_mail:
-        send_error_email(
-            error=error,
-            add_screenshot=context.add_screenshot,
-            process_name=context.process_name,
+        _aggregator.add(error_info, context.process_name, context.add_screenshot)
+
+
+def _submit_email(send: Callable[..., None], *args) -> Future:
+    """Run an email sending function on the background email thread."""
+    global _email_executor  # noqa: PLW0603
+
+    def run() -> None:
+        try:
+            send(*args)
+        except Exception as e:
+            logger.error("Error sending error email: %s", e)
+
+    with _email_lock:
+        if _email_executor is None:
+            _email_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="error-email"
+            )
+        future = _email_executor.submit(run)
+        _pending_emails.add(future)
+
+    future.add_done_callback(_discard_pending_email)
+    return future
+
+
+def _discard_pending_email(future: Future) -> None:
+    with _email_lock:
+        _pending_emails.discard(future)
+
+
+def flush_error_emails(timeout: float = config.ERROR_EMAIL_TIMEOUT) -> None:
+    """Send the pending error digest and wait for error emails still being sent."""
+    _aggregator.flush()
+
+    with _email_lock:
+        pending = list(_pending_emails)
+
+    if pending:
+        logger.info("Waiting for %d pending error email(s)...", len(pending))
+        _, not_done = wait(pending, timeout=timeout)
+        if not_done:
+            logger.warning("%d error email(s) were not sent in time.", len(not_done))
+
+    if _aggregator.errors:
+        logger.info(
+            "Error emails: %d error(s) reported in %d digest(s), "
+            "%d duplicate(s) suppressed.",
+            _aggregator.errors,
+            _aggregator.digests,
+            _aggregator.suppressed,
+        )
+
+
+def _render_entry(entry: ErrorDigestEntry, screenshot_cid: str | None) -> str:
+    """Render one digest entry as HTML, with its screenshot if it has one."""
+    occurrences = ""
+    if entry.count > 1:
+        occurrences = (
+            f"<p>Occurrences: {entry.count} between "
+            f"{entry.first_seen:%H:%M:%S} and {entry.last_seen:%H:%M:%S} UTC</p>"
         )
+    screenshot = ""
+    if screenshot_cid:
+        screenshot = f'<img src="cid:{screenshot_cid[1:-1]}" alt="Screenshot">'
+    return f"""
+                        <p>Error type: {html.escape(entry.error_type)}</p>
+                        <p>Error message: {html.escape(entry.message)}</p>
+                        {occurrences}
+                        <pre>{html.escape(entry.traceback)}</pre>
+                        {screenshot}"""
+
 
+def _entry_screenshot(entry: ErrorDigestEntry) -> tuple[bytes, str] | None:
+    """Wait for the screenshot of an entry, None if it has none or it failed."""
+    if entry.screenshot is None:
+        return None
+    try:
+        return entry.screenshot.result()
+    except Exception as e:
+        logger.warning("Could not grab screenshot: %s", e)
+        return None
 
-def send_error_email(
-    error: ProcessError | BusinessError,
-    add_screenshot: bool = False,
+
+def send_error_digest(
+    entries: list[ErrorDigestEntry],
     process_name: str | None = None,
 ) -> None:
     """
-    Send email to defined recipient with error information
+    Send one email listing the given errors.
+
     Args:
-        error (ProcessError | BusinessError): The error to include in the email.
-        add_screenshot (bool): Whether to include a screenshot in the email.
-        process_name (str | None): Name of the process where the error occurred.
-    Returns:
-        None
+        entries (list[ErrorDigestEntry]): The errors to include, one per
+            fingerprint, each with the screenshot taken at its first occurrence.
+        process_name (str | None): Name of the process where the errors occurred.
     Raises:
         Exception: If sending the email fails.
     """
-    rpa_conn = RPAConnection(db_env="PROD", commit=False)
-    with rpa_conn:
-        error_email = rpa_conn.get_constant("Error Email")["value"]
-        error_sender = rpa_conn.get_constant("Email Friend")[
-            "value"
-        ]  # Find in database...
-        smtp_server = rpa_conn.get_constant("smtp_server")["value"]
-        smtp_port = rpa_conn.get_constant("smtp_port")["value"]
+    error_email = get_constant("Error Email")["value"]
+    error_sender = get_constant("Email Friend")["value"]
+    smtp_server = get_constant("smtp_server")["value"]
+    smtp_port = get_constant("smtp_port")["value"]
+
+    total = sum(entry.count for entry in entries)
+    shown = entries[: config.ERROR_DIGEST_MAX_ENTRIES]
+
     # Create message
     msg = EmailMessage()
     msg["to"] = error_email
     msg["from"] = error_sender
-    msg["subject"] = "Error screenshot" + f": {process_name}" if process_name else ""
+    subject = "Error screenshot" + f": {process_name}" if process_name else ""
+    if total > 1:
+        subject += f" ({total} errors, {len(entries)} distinct)"
+    msg["subject"] = subject
 
-    # Create an HTML message with the exception and screenshot
-    error_dict = error.__dictinfo__()
+    # Create an HTML message with the exceptions and their screenshots
+    screenshots = [(_entry_screenshot(entry), make_msgid()) for entry in shown]
+    body = "<hr>".join(
+        _render_entry(entry, cid if screenshot else None)
+        for entry, (screenshot, cid) in zip(shown, screenshots, strict=True)
+    )
+    if len(entries) > len(shown):
+        body += f"<p>{len(entries) - len(shown)} more distinct error(s) left out.</p>"
 
-    if add_screenshot:
-        screenshot = grab_screenshot()
-        html_message = f"""
-                <html>
-                    <body>
-                        <p>Error type: {error_dict["type"]}</p>
-                        <p>Error message: {error_dict["message"]}</p>
-                        <p>{error_dict["traceback"]}</p>
-                        <img src="data:image/png;base64,{screenshot}" alt="Screenshot">
-                    </body>
-                </html>
-            """
-    else:
-        html_message = f"""
+    html_message = f"""
                 <html>
-                    <body>
-                        <p>Error type: {error_dict["type"]}</p>
-                        <p>Error message: {error_dict["message"]}</p>
-                        <p>{error_dict["traceback"]}</p>
+                    <body>{body}
                     </body>
                 </html>
             """
@@ -118,25 +333,102 @@ def send_error_email(
     msg.set_content("Please enable HTML to view this message.")
     msg.add_alternative(html_message, subtype="html")
 
+    for screenshot, cid in screenshots:
+        if screenshot:
+            image_data, image_subtype = screenshot
+            msg.get_payload()[1].add_related(
+                image_data, maintype="image", subtype=image_subtype, cid=cid
+            )
+
     # Send message
-    with smtplib.SMTP(smtp_server, smtp_port) as smtp:
-        smtp.starttls()
-        smtp.send_message(msg)
+    send_smtp_message(smtp_server, smtp_port, msg)
+
 
+def _encode_screenshot(image: "Image", image_format: str) -> bytes:
+    """Encode an image in the given format with size-oriented settings."""
+    buffer = BytesIO()
+    if image_format == "PNG":
+        image.save(buffer, format="PNG", optimize=True)
+    else:
+        image.save(
+            buffer,
+            format=image_format,
+            quality=config.SCREENSHOT_QUALITY,
+            optimize=True,
+        )
+    return buffer.getvalue()
 
-def grab_screenshot() -> str:
+
+def _capture_screenshot() -> "Future[tuple[bytes, str] | None] | None":
     """
-    Grabs screenshot.
+    Grab the screen now and encode the capture in the background.
 
     Returns:
-        str: Screenshot in base64 format.
-    Raises:
-        Exception: If screenshot capture fails.
+        Future | None: The pending result of encode_screenshot, or None if
+            the screen could not be grabbed.
     """
-    # Take screenshot and convert to base64
-    screenshot = ImageGrab.grab()
-    buffer = BytesIO()
-    screenshot.save(buffer, format="PNG")
-    screenshot_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    global _screenshot_executor  # noqa: PLW0603
+
+    try:
+        from PIL import ImageGrab  # noqa: PLC0415
+
+        screenshot = ImageGrab.grab()
+    except Exception as e:
+        logger.warning("Could not grab screenshot: %s", e)
+        return None
+
+    with _email_lock:
+        if _screenshot_executor is None:
+            _screenshot_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="error-screenshot"
+            )
+        return _screenshot_executor.submit(encode_screenshot, screenshot)
+
+
+def encode_screenshot(screenshot: "Image") -> tuple[bytes, str] | None:
+    """
+    Encode a screen capture for an error email.
+
+    The capture is downscaled to SCREENSHOT_MAX_WIDTH and encoded as
+    SCREENSHOT_FORMAT, then downscaled further until it fits within
+    SCREENSHOT_MAX_BYTES.
+
+    Args:
+        screenshot (Image): The screen capture.
+
+    Returns:
+        tuple[bytes, str] | None: The encoded screenshot and its MIME image
+            subtype, or None if it could not be made small enough.
+    """
+    from PIL import Image  # noqa: PLC0415
+
+    image_format = config.SCREENSHOT_FORMAT.upper()
+    if image_format == "JPEG":
+        screenshot = screenshot.convert("RGB")
+
+    width = screenshot.width
+    if config.SCREENSHOT_MAX_WIDTH:
+        width = min(width, config.SCREENSHOT_MAX_WIDTH)
+
+    while True:
+        image = screenshot
+        if width < screenshot.width:
+            height = max(1, round(screenshot.height * width / screenshot.width))
+            image = screenshot.resize(
+                (width, height), Image.Resampling.BILINEAR, reducing_gap=2.0
+            )
+
+        data = _encode_screenshot(image, image_format)
+        if not config.SCREENSHOT_MAX_BYTES or len(data) <= config.SCREENSHOT_MAX_BYTES:
+            return data, image_format.lower()
+
+        width = int(width * SCREENSHOT_DOWNSCALE_STEP)
+        if width < MIN_SCREENSHOT_WIDTH:
+            logger.warning(
+                "Screenshot does not fit in %d bytes and was left out.",
+                config.SCREENSHOT_MAX_BYTES,
+            )
+            return None
+
 
-    return screenshot_base64
+_aggregator = ErrorAggregator()
@@ -1,7 +1,9 @@
 """Module to handle process finalization"""
 # from mbu_rpa_core.exceptions import ProcessError, BusinessError
 
+from processes.subprocesses.db_handler import flush_form_statuses
+
 
 def finalize_process():
     """Function to handle process finalization"""
-    return
+    flush_form_statuses()
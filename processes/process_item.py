@@ -1,41 +1,104 @@
 """Module to handle item processing"""
 
 import logging
+from typing import BinaryIO
 
+from helpers.attachment_cache import discard_cached_attachment
+from helpers.metrics import timed_function
+from helpers.send_ledger import get_send_ledger
 from processes.subprocesses.context_handler import EmailContext
 from processes.subprocesses.credentials_constant_handler import (
     get_constant,
     get_credentials,
 )
-from processes.subprocesses.db_handler import update_form_status_in_database
+from processes.subprocesses.db_handler import queue_form_status_update
 from processes.subprocesses.email_handler import get_attachment, send_email
+from processes.subprocesses.lease_handler import (
+    PROCESS_STAGE,
+    acquire_form_lease,
+    finish_form_leases,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def process_item(item_data: dict, item_reference: str) -> None:
+def build_email_context(attachment_data: BinaryIO, item_reference: str) -> EmailContext:
+    """Build the email context for an item from cached constants."""
+    return EmailContext(
+        data=attachment_data,
+        form_id=item_reference,
+        email_to=get_constant("rfg_email")["value"],
+        email_from=get_constant("E-mail")["value"],
+        smtp_server=get_constant("smtp_adm_server")["value"],
+        smtp_port=int(get_constant("smtp_port")["value"]),
+    )
+
+
+def log_already_sent(item_reference: str, sent: dict) -> None:
+    """Log that the email of a retried item is not sent again."""
+    logger.info(
+        "Email for form ID %s was already sent at %s (attachment sha256 %s), "
+        "only updating its status.",
+        item_reference,
+        sent["sent_at"],
+        sent["attachment_sha256"],
+    )
+
+
+def log_sent_by_other_node(item_reference: str) -> None:
+    """Log that another node has already sent the email of an item."""
+    logger.info(
+        "Email for form ID %s was already sent by another node, "
+        "only updating its status.",
+        item_reference,
+    )
+
+
+@timed_function("process_item")
+def process_item(
+    item_data: dict, item_reference: str, attachment: BinaryIO | None = None
+) -> None:
     """Function to handle item processing"""
+    sent_by_other_node = acquire_form_lease(item_reference, PROCESS_STAGE)
+    email_sent = sent_by_other_node
     try:
-        api_key = get_credentials("os2_api")["decrypted_password"]
+        attachment_url = item_data.get("attachment_url", "")
+        ledger = get_send_ledger()
+        sent = None if email_sent else ledger.get(item_reference, attachment_url)
+
+        if sent_by_other_node:
+            log_sent_by_other_node(item_reference)
+        elif sent:
+            log_already_sent(item_reference, sent)
+            email_sent = True
+        else:
+            attachment_data = attachment
+            if attachment_data is None:
+                api_key = get_credentials("os2_api")["decrypted_password"]
 
-        attachment_data = get_attachment(
-            url=item_data.get("attachment_url", ""),
-            api_key=api_key,
-        )
+                attachment_data = get_attachment(
+                    url=attachment_url,
+                    api_key=api_key,
+                )
 
-        email_context = EmailContext(
-            data=attachment_data,
-            form_id=item_reference,
-            email_to=get_constant("rfg_email")["value"],
-            email_from=get_constant("E-mail")["value"],
-            smtp_server=get_constant("smtp_adm_server")["value"],
-            smtp_port=int(get_constant("smtp_port")["value"]),
-        )
+            try:
+                email_context = build_email_context(attachment_data, item_reference)
 
-        send_email(context=email_context)
+                send_email(context=email_context)
 
-        update_form_status_in_database(form_id=item_reference, status="Manual")
+                ledger.record(item_reference, attachment_url, attachment_data)
+                email_sent = True
+                discard_cached_attachment(attachment_url)
+            finally:
+                if attachment is None:
+                    attachment_data.close()
+
+        queue_form_status_update(form_id=item_reference, status="Manual")
 
     except Exception as e:
         logger.error("Error processing item %s: %s", item_reference, e)
         raise
+
+    finally:
+        if not sent_by_other_node:
+            finish_form_leases([item_reference], PROCESS_STAGE, email_sent)
@@ -3,37 +3,44 @@
 import asyncio
 import json
 import logging
+import random
+import threading
+import time
+from collections.abc import (
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime
 
 from automation_server_client import Workqueue
 
 from helpers import config
+from helpers.metrics import timed_function
+from processes.subprocesses.form_data_handler import (
+    FORM_TYPE_ATTACHMENT_KEYS,
+    get_attachment_url_extractor,
+)
 from processes.subprocesses.forms_handler import get_forms
+from processes.subprocesses.priority_handler import assign_priority
 
 logger = logging.getLogger(__name__)
 
+_DONE = object()
 
-def retrieve_items_for_queue() -> list[dict]:
-    """Function to populate queue"""
-    forms = get_forms()
 
-    if forms is None:
-        logger.info("No forms found")
-        return []
+def retrieve_items_for_queue() -> Iterator[dict]:
+    """Function to populate queue, yielding one queue item per valid form"""
+    extract_attachment_url = get_attachment_url_extractor()
+    now = datetime.now(UTC)
 
-    data = []
-    references = []
-
-    FORM_TYPE_ATTACHMENT_KEYS = {
-        "respekt_for_graenser": "re",
-        "respekt_for_graenser_privat": "re",
-        "indmeld_kraenkelser_af_boern": "respekt_for",
-    }
-
-    for form in forms:
+    for form in get_forms():
         form_id = form.get("form_id")
         form_type = form.get("form_type")
         try:
-            form_data = json.loads(form.get("form_data", "{}"))
             attachment_key = FORM_TYPE_ATTACHMENT_KEYS.get(form_type)
 
             if not attachment_key:
@@ -42,9 +49,19 @@ def retrieve_items_for_queue() -> list[dict]:
                 )
                 continue
 
-            attachment_url = form_data["data"]["attachments"][attachment_key]["url"]
-            references.append(form_id)
-            data.append({"attachment_url": attachment_url})
+            attachment_url = extract_attachment_url(
+                form.get("form_data", "{}"), attachment_key
+            )
+            yield {
+                "reference": form_id,
+                "data": {
+                    "attachment_url": attachment_url,
+                    "priority": assign_priority(
+                        form_type, form.get("form_submitted_date"), now
+                    ),
+                    "queued_at": datetime.now(UTC).isoformat(),
+                },
+            }
         except (json.JSONDecodeError, KeyError, TypeError) as e:
             logger.warning(
                 "Error parsing form data for form_id %s (type: %s): %s",
@@ -54,60 +71,226 @@ def retrieve_items_for_queue() -> list[dict]:
             )
             continue
 
-    items = [
-        {"reference": ref, "data": d} for ref, d in zip(references, data, strict=True)
-    ]
 
-    return items
+async def stream_in_thread(
+    items: Iterable[dict], buffer_size: int = config.QUEUE_STREAM_BUFFER
+) -> AsyncIterator[dict]:
+    """
+    Iterate a blocking iterable in a worker thread and yield its items async.
+
+    At most `buffer_size` items are buffered between the thread and the
+    consumer, so the consumer can start before the iterable is exhausted.
+    """
+    loop = asyncio.get_running_loop()
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+    stopped = threading.Event()
+
+    def produce() -> None:
+        try:
+            for it in items:
+                if stopped.is_set():
+                    return
+                asyncio.run_coroutine_threadsafe(buffer.put(it), loop).result()
+        except Exception as e:
+            asyncio.run_coroutine_threadsafe(buffer.put(e), loop).result()
+        finally:
+            if not stopped.is_set():
+                asyncio.run_coroutine_threadsafe(buffer.put(_DONE), loop).result()
+
+    producer = loop.run_in_executor(None, produce)
+
+    try:
+        while True:
+            it = await buffer.get()
+            if it is _DONE:
+                break
+            if isinstance(it, Exception):
+                raise it
+            yield it
+    finally:
+        stopped.set()
+        while not producer.done():
+            try:
+                buffer.get_nowait()
+            except asyncio.QueueEmpty:
+                await asyncio.sleep(0.01)
+        await producer
+
+
+async def _aiterate(items: Iterable[dict] | AsyncIterable[dict]) -> AsyncIterator[dict]:
+    """Iterate sync and async iterables alike."""
+    if isinstance(items, AsyncIterable):
+        async for it in items:
+            yield it
+    else:
+        for it in items:
+            yield it
+
+
+async def _achunks(
+    items: Iterable[dict] | AsyncIterable[dict], size: int
+) -> AsyncIterator[list[dict]]:
+    """Group items into lists of at most `size` items."""
+    chunk: list[dict] = []
+    async for it in _aiterate(items):
+        chunk.append(it)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to backend latency and errors.
+
+    The limit grows by roughly one slot per round trip while requests are
+    fast and succeed, and is cut by ADD_BACKOFF_FACTOR as soon as a request
+    fails or is slower than ADD_LATENCY_TARGET.
+    """
+
+    def __init__(
+        self,
+        initial: int = config.ADD_INITIAL_CONCURRENCY,
+        minimum: int = config.ADD_MIN_CONCURRENCY,
+        maximum: int = config.MAX_CONCURRENCY,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        """Wait for a free slot."""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency: float, succeeded: bool) -> None:
+        """Free a slot and adjust the limit from the outcome of the request."""
+        async with self._condition:
+            self.in_flight -= 1
+            if not succeeded or latency > config.ADD_LATENCY_TARGET:
+                self.limit = max(self.minimum, self.limit * config.ADD_BACKOFF_FACTOR)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
 
+@timed_function("add_chunk")
+def _add_chunk(workqueue: Workqueue, chunk: list[dict]) -> tuple[list[dict], int]:
+    """
+    Add a chunk of items one by one.
+
+    Returns:
+        tuple[list[dict], int]: The items that were not added and the number
+            of requests made.
+    """
+    failed = []
+    for it in chunk:
+        reference = str(it.get("reference") or "")
+        try:
+            workqueue.add_item({"item": it}, reference)
+        except Exception as e:
+            logger.warning(f"Error adding {reference}: {e}")
+            failed.append(it)
+    return failed, len(chunk)
 
-async def concurrent_add(workqueue: Workqueue, items: list[dict]) -> None:
+
+async def concurrent_add(
+    workqueue: Workqueue,
+    items: Iterable[dict] | AsyncIterable[dict],
+    on_added: Callable[[str], None] | None = None,
+) -> int:
     """
     Populate the workqueue with items to be processed.
     Uses concurrency and retries with exponential backoff.
 
+    Items are grouped into chunks of ADD_CHUNK_SIZE which are added one by
+    one on a dedicated thread pool. The number of chunks in flight adapts to
+    backend latency and errors, and failed items are retried per chunk with
+    exponential backoff and jitter.
+
     Args:
         workqueue (Workqueue): The workqueue to populate.
-        items (list[dict]): List of items to add to the queue.
-        logger (logging.Logger): Logger for logging messages.
+        items (Iterable[dict] | AsyncIterable[dict]): Items to add to the queue.
+        on_added (Callable[[str], None] | None): Called with the reference of
+            every item that was added.
 
     Returns:
-        None
-
-    Raises:
-        Exception: If adding an item fails after all retries.
+        int: The number of items that could not be added after all retries.
     """
-    sem = asyncio.Semaphore(config.MAX_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    limiter = AdaptiveLimiter()
+    counts = {"succeeded": 0, "failed": 0}
+    in_flight: set[asyncio.Task] = set()
 
-    async def add_one(it: dict):
-        reference = str(it.get("reference") or "")
-        data = {"item": it}
-
-        async with sem:
-            for attempt in range(1, config.MAX_RETRIES + 1):
-                try:
-                    await asyncio.to_thread(workqueue.add_item, data, reference)
-                    return True
-                except Exception as e:
-                    if attempt >= config.MAX_RETRIES:
-                        logger.error(
-                            f"Failed to add item {reference} after {attempt} attempts: {e}"
-                        )
-                        return False
-                    backoff = config.RETRY_BASE_DELAY * (2 ** (attempt - 1))
-                    logger.warning(
-                        f"Error adding {reference} (attempt {attempt}/{config.MAX_RETRIES}). "
-                        f"Retrying in {backoff:.2f}s... {e}"
-                    )
-                    await asyncio.sleep(backoff)
-
-    if not items:
+    async def add_chunk(chunk: list[dict], pool: ThreadPoolExecutor) -> None:
+        remaining = chunk
+
+        for attempt in range(1, config.MAX_RETRIES + 1):
+            await limiter.acquire()
+            started = time.monotonic()
+            try:
+                failed, requests = await loop.run_in_executor(
+                    pool, _add_chunk, workqueue, remaining
+                )
+                error = None
+            except Exception as e:
+                failed, requests, error = remaining, 1, e
+            latency = (time.monotonic() - started) / max(requests, 1)
+            await limiter.release(latency, succeeded=not failed)
+
+            failed_ids = {id(it) for it in failed}
+            for it in remaining:
+                if id(it) not in failed_ids:
+                    counts["succeeded"] += 1
+                    if on_added:
+                        on_added(str(it.get("reference") or ""))
+
+            remaining = failed
+            if not remaining:
+                return
+
+            if attempt >= config.MAX_RETRIES:
+                break
+
+            backoff = config.RETRY_BASE_DELAY * (2 ** (attempt - 1))
+            backoff += random.uniform(0, backoff)
+            logger.warning(
+                f"Error adding {len(remaining)} item(s) (attempt {attempt}/{config.MAX_RETRIES}). "
+                f"Retrying in {backoff:.2f}s... {error or ''}"
+            )
+            await asyncio.sleep(backoff)
+
+        counts["failed"] += len(remaining)
+        for it in remaining:
+            logger.error(
+                f"Failed to add item {it.get('reference')} after {config.MAX_RETRIES} attempts"
+            )
+
+    with ThreadPoolExecutor(
+        max_workers=config.MAX_CONCURRENCY, thread_name_prefix="queue-add"
+    ) as pool:
+        async for chunk in _achunks(items, config.ADD_CHUNK_SIZE):
+            while len(in_flight) >= config.MAX_CONCURRENCY:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            task = asyncio.create_task(add_chunk(chunk, pool))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    total = counts["succeeded"] + counts["failed"]
+    if not total:
         logger.info("No new items to add.")
-        return
+        return 0
 
-    results = await asyncio.gather(*(add_one(i) for i in items))
-    successes = sum(1 for r in results if r)
-    failures = len(results) - successes
     logger.info(
-        f"Summary: {successes} succeeded, {failures} failed out of {len(results)}"
+        f"Summary: {counts['succeeded']} succeeded, {counts['failed']} failed out of {total}"
+        f" (final concurrency limit {int(limiter.limit)})"
     )
+    return counts["failed"]
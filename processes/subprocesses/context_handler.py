@@ -1,13 +1,14 @@
 """Context handler"""
 
 from dataclasses import dataclass
+from typing import BinaryIO
 
 
 @dataclass
 class EmailContext:
     """Context dataclass for email sending"""
 
-    data: bytes
+    data: BinaryIO
     form_id: str
     email_to: str
     email_from: str
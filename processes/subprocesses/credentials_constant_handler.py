@@ -1,29 +1,112 @@
 """Module to handle credentials and constants retrieval from database"""
 
 import logging
+import threading
+import time
 from typing import Any
 
-from mbu_dev_shared_components.database.connection import RPAConnection
+from helpers import config
+from helpers.metrics import timed_function
 
 logger = logging.getLogger(__name__)
 
+_cache: dict[tuple[str, str], tuple[float, dict[str, Any]]] = {}
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
 
+
+def _get_cached(kind: str, name: str) -> dict[str, Any] | None:
+    """Return a cached value if present and not expired, and count the lookup."""
+    with _cache_lock:
+        entry = _cache.get((kind, name))
+        if entry and time.monotonic() - entry[0] < config.CACHE_TTL_SECONDS:
+            _cache_stats["hits"] += 1
+            return entry[1]
+        _cache_stats["misses"] += 1
+        return None
+
+
+def _set_cached(kind: str, name: str, value: dict[str, Any]) -> None:
+    """Store a value in the cache with the current timestamp."""
+    with _cache_lock:
+        _cache[(kind, name)] = (time.monotonic(), value)
+
+
+def _connect():
+    """Open a connection to the RPA database, importing its driver on first use."""
+    from mbu_dev_shared_components.database.connection import (  # noqa: PLC0415
+        RPAConnection,
+    )
+
+    return RPAConnection()
+
+
+def preload(
+    credential_names: tuple[str, ...] = config.PRELOAD_CREDENTIALS,
+    constant_names: tuple[str, ...] = config.PRELOAD_CONSTANTS,
+) -> None:
+    """
+    Load all given credentials and constants using a single database connection.
+
+    Preloading is best effort: when the RPA database cannot be reached the
+    error is logged and the values are fetched on first use instead.
+    """
+    logger.info(
+        "Preloading %d credentials and %d constants.",
+        len(credential_names),
+        len(constant_names),
+    )
+
+    try:
+        with _connect() as conn:
+            for name in credential_names:
+                _set_cached("credential", name, conn.get_credential(name))
+            for name in constant_names:
+                _set_cached("constant", name, conn.get_constant(name))
+    except Exception as e:
+        logger.error("Error preloading credentials and constants: %s", e)
+
+
+def invalidate_cache() -> None:
+    """Drop all cached credentials and constants."""
+    with _cache_lock:
+        _cache.clear()
+
+
+def get_cache_stats() -> dict[str, int]:
+    """Return cache hit/miss counters."""
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_cache))
+
+
+@timed_function("get_credentials")
 def get_credentials(credential_name: str) -> dict[str, Any]:
-    """Retrieve a credential by name from the database."""
+    """Retrieve a credential by name from the cache or the database."""
+    cached = _get_cached("credential", credential_name)
+    if cached is not None:
+        return cached
+
     try:
-        with RPAConnection() as conn:
+        with _connect() as conn:
             credential = conn.get_credential(f"{credential_name}")
+        _set_cached("credential", credential_name, credential)
         return credential
     except Exception as e:
         logger.error("Error retrieving API key: %s", e)
         raise
 
 
+@timed_function("get_constant")
 def get_constant(constant_name: str) -> dict[str, Any]:
-    """Retrieve a constant by name from the database."""
+    """Retrieve a constant by name from the cache or the database."""
+    cached = _get_cached("constant", constant_name)
+    if cached is not None:
+        return cached
+
     try:
-        with RPAConnection() as conn:
+        with _connect() as conn:
             constant = conn.get_constant(f"{constant_name}")
+        _set_cached("constant", constant_name, constant)
         return constant
     except Exception as e:
         logger.error("Error retrieving constant: %s", e)
@@ -1,34 +1,102 @@
 """Database handler for updating form status in the journalizing database."""
 
 import logging
-import os
-import urllib.parse
+import threading
+from collections import defaultdict
 
-from sqlalchemy import create_engine, text
+from helpers import config
+from helpers.circuit_breaker import CircuitOpenError, circuit_breaker, health_check
+from helpers.metrics import timed_function
+from helpers.send_ledger import get_send_ledger
+from processes.subprocesses.engine_handler import get_engine
 
 logger = logging.getLogger(__name__)
 
+_flush_lock = threading.Lock()
 
-def update_form_status_in_database(form_id: str, status: str) -> None:
-    """Update form status in the journalizing database."""
-    logger.info("Updating form status in the database for form ID: %s", form_id)
 
-    try:
-        params = urllib.parse.quote_plus(os.environ["DBCONNECTIONSTRINGPROD"])
-        connection_string = f"mssql+pyodbc:///?odbc_connect={params}"
-        engine = create_engine(connection_string)
+@health_check("db")
+def check_database() -> None:
+    """Run a trivial query to see whether the journalizing database answers."""
+    from sqlalchemy import text  # noqa: PLC0415
+
+    with get_engine().connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def queue_form_status_update(form_id: str, status: str) -> None:
+    """
+    Keep a form status update in the send ledger and flush when enough are owed.
+
+    Args:
+        form_id (str): The form to update.
+        status (str): The new status of the form.
+    """
+    pending = get_send_ledger().queue_status(form_id, status)
+
+    logger.info("Queued status %s for form ID: %s", status, form_id)
+
+    if pending >= config.STATUS_BATCH_SIZE:
+        try:
+            flush_form_statuses()
+        except CircuitOpenError as e:
+            logger.warning("Keeping %d status update(s) queued: %s", pending, e)
+
+
+def get_pending_form_ids() -> list[str]:
+    """Return the forms whose status update has not been written yet."""
+    return sorted(get_send_ledger().pending_statuses())
+
+
+@circuit_breaker("db")
+@timed_function("flush_form_statuses")
+def flush_form_statuses() -> None:
+    """
+    Write all queued form statuses with one set-based UPDATE per status.
+
+    The queue is kept in the send ledger, so statuses are only forgotten once
+    written and a failed flush is retried by the next flush, in this run or
+    the next.
+    """
+    with _flush_lock:
+        ledger = get_send_ledger()
+        pending = ledger.pending_statuses()
+
+        if not pending:
+            return
+
+        form_ids_by_status: dict[str, list[str]] = defaultdict(list)
+        for form_id, status in pending.items():
+            form_ids_by_status[status].append(form_id)
+
+        logger.info("Flushing %d queued form status update(s).", len(pending))
+
+        from sqlalchemy import bindparam, text  # noqa: PLC0415
+
         query = text(
             """UPDATE [RPA].[journalizing].[Journalizing]
             SET status = :status
-            WHERE form_id = :form_id"""
-        )
+            WHERE form_id IN :form_ids"""
+        ).bindparams(bindparam("form_ids", expanding=True))
 
-        with engine.connect() as connection:
-            connection.execute(query, {"status": status, "form_id": form_id})
-            connection.commit()
+        try:
+            with get_engine().connect() as connection:
+                for status, form_ids in form_ids_by_status.items():
+                    for start in range(0, len(form_ids), config.STATUS_BATCH_SIZE):
+                        connection.execute(
+                            query,
+                            {
+                                "status": status,
+                                "form_ids": form_ids[
+                                    start : start + config.STATUS_BATCH_SIZE
+                                ],
+                            },
+                        )
+                connection.commit()
 
-        logger.info("Form ID %s status updated to %s.", form_id, status)
+        except Exception as e:
+            logger.error("Error flushing %d form status update(s): %s", len(pending), e)
+            raise
 
-    except Exception as e:
-        logger.error("Error updating form status for form ID %s: %s", form_id, e)
-        raise
+        ledger.clear_statuses(pending)
+        logger.info("Flushed %d form status update(s).", len(pending))
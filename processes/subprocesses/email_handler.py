@@ -1,40 +1,204 @@
 """Send email with attachment subprocess."""
 
+import io
 import logging
-import smtplib
+import tempfile
 from email.message import EmailMessage
-from typing import TYPE_CHECKING
-
-from mbu_dev_shared_components.os2forms.documents import download_file_bytes
+from typing import TYPE_CHECKING, BinaryIO
+from urllib.parse import urlsplit
+
+from helpers import config
+from helpers.attachment_cache import get_attachment_cache
+from helpers.circuit_breaker import circuit_breaker, health_check
+from helpers.metrics import record_bytes, timed_function
+from processes.subprocesses.smtp_handler import (
+    StreamedAttachment,
+    check_smtp_server,
+    encoding_buffer_size,
+    send_smtp_message,
+)
 
 if TYPE_CHECKING:
+    import requests
+
     from processes.process_item import EmailContext
 
 logger = logging.getLogger(__name__)
 
+# The servers last called, which the health checks probe during an outage.
+_os2forms_origin: str | None = None
+_smtp_server: tuple[str, int] | None = None
+
+
+@health_check("os2forms")
+def check_os2forms() -> None:
+    """Send a HEAD request to the OS2Forms server attachments were fetched from."""
+    import requests  # noqa: PLC0415
+
+    if _os2forms_origin is None:
+        return
+
+    response = requests.head(
+        _os2forms_origin, timeout=config.ATTACHMENT_DOWNLOAD_TIMEOUT
+    )
+    # Any answer but a server error shows the server is up.
+    if response.status_code >= requests.codes.internal_server_error:
+        response.raise_for_status()
+
+
+@health_check("smtp")
+def check_smtp() -> None:
+    """Open a session to the SMTP server emails were last sent through."""
+    if _smtp_server is not None:
+        check_smtp_server(*_smtp_server)
+
+
+def _download(
+    url: str, api_key: str, cached: dict | None = None
+) -> "tuple[BinaryIO | None, requests.Response]":
+    """
+    Stream an attachment into a temporary file.
+
+    Args:
+        url (str): The url of the attachment.
+        api_key (str): The OS2Forms API key.
+        cached (dict | None): The cache entry to revalidate with its validators.
+
+    Returns:
+        tuple[BinaryIO | None, requests.Response]: The attachment, or None if
+            the server answered that the cached copy is current, and the response.
+    """
+    import requests  # noqa: PLC0415
+
+    headers = {"Content-Type": "application/json", "api-key": api_key}
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    with requests.get(
+        url,
+        headers=headers,
+        timeout=config.ATTACHMENT_DOWNLOAD_TIMEOUT,
+        stream=True,
+    ) as response:
+        if cached and response.status_code == requests.codes.not_modified:
+            return None, response
+        response.raise_for_status()
+
+        attachment = tempfile.SpooledTemporaryFile(  # noqa: SIM115
+            max_size=config.ATTACHMENT_SPOOL_MAX_BYTES
+        )
+        try:
+            for chunk in response.iter_content(config.ATTACHMENT_CHUNK_BYTES):
+                attachment.write(chunk)
+        except Exception:
+            attachment.close()
+            raise
+        return attachment, response
+
+
+def _fetch(url: str, api_key: str) -> BinaryIO:
+    """Return an attachment from the cache if it is current, else download it."""
+    cache = get_attachment_cache()
+    cached = cache.get(url) if cache else None
+
+    if cached and not (cached["etag"] or cached["last_modified"]):
+        # Without validators the attachment of a submitted form is immutable.
+        attachment = cache.load(url)
+        if attachment is not None:
+            logger.info("Using cached attachment.")
+            return attachment
+        cached = None
+
+    attachment, response = _download(url, api_key, cached)
+    if attachment is None:
+        attachment = cache.load(url)
+        if attachment is not None:
+            logger.info("Using cached attachment, the server reports it unchanged.")
+            return attachment
+        attachment, response = _download(url, api_key)
+
+    if cache and attachment_size(attachment):
+        cache.store(
+            url,
+            attachment,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+    return attachment
+
+
+@circuit_breaker("os2forms")
+@timed_function("get_attachment")
+def get_attachment(url: str, api_key: str) -> BinaryIO:
+    """
+    Fetch attachment from OS2Forms by url.
+
+    The attachment is streamed into a temporary file that stays in memory up
+    to ATTACHMENT_SPOOL_MAX_BYTES and is spooled to disk beyond that. Copies
+    are kept in the attachment cache, so retries do not download it again.
+
+    Args:
+        url (str): The url of the attachment.
+        api_key (str): The OS2Forms API key.
+
+    Returns:
+        BinaryIO: The attachment, which the caller must close.
+    """
+    global _os2forms_origin  # noqa: PLW0603
 
-def get_attachment(url: str, api_key: str) -> bytes:
-    """Fetch attachment from OS2Forms by url."""
     logger.info("Fetching attachment from OS2Forms...")
 
+    parts = urlsplit(url)
+    _os2forms_origin = f"{parts.scheme}://{parts.netloc}/"
+
     try:
-        file_bytes = download_file_bytes(url, api_key)
+        attachment = _fetch(url, api_key)
 
-        if not file_bytes:
+        size = attachment_size(attachment)
+        if not size:
+            attachment.close()
             logger.error("No file bytes found.")
             raise ValueError("No file bytes found.")
 
         logger.info("Successfully fetched attachment.")
+        record_bytes("get_attachment", size)
 
-        return file_bytes
+        return attachment
 
     except Exception as e:
         logger.error("Error fetching attachment: %s", e)
         raise
 
 
+def attachment_size(attachment: BinaryIO) -> int:
+    """Return the size of an attachment, leaving it positioned at the start."""
+    size = attachment.seek(0, io.SEEK_END)
+    attachment.seek(0)
+    return size
+
+
+def estimate_attachment_memory(attachment: BinaryIO) -> int:
+    """
+    Estimate the memory in bytes an attachment holds while it is sent.
+
+    This is the in-memory part of the spooled file plus the base64 encoding
+    buffer. It is computed from the size, not measured, and leaves out the
+    chunk buffers used to copy the attachment out of the cache and to hash it
+    for the send ledger.
+    """
+    size = attachment_size(attachment)
+    spooled = size if size <= config.ATTACHMENT_SPOOL_MAX_BYTES else 0
+    return spooled + encoding_buffer_size(size)
+
+
+@circuit_breaker("smtp")
+@timed_function("send_email")
 def send_email(context: "EmailContext") -> None:
     """Send email with attachment."""
+    global _smtp_server  # noqa: PLW0603
+
     logger.info("Sending email with attachment for form ID: %s", context.form_id)
 
     try:
@@ -60,23 +224,28 @@ def send_email(context: "EmailContext") -> None:
             """
         )
 
-        msg.add_attachment(
-            context.data,
-            maintype="application",
-            subtype="octet-stream",
-            filename="respekt-for-graenser.pdf",
-        )
-
         if not context.smtp_server or not context.smtp_port:
             raise ValueError(
                 "SMTP_SERVER and SMTP_PORT environment variables must be set"
             )
+        _smtp_server = (context.smtp_server, int(context.smtp_port))
+
+        send_smtp_message(
+            context.smtp_server,
+            context.smtp_port,
+            msg,
+            attachment=StreamedAttachment(
+                file=context.data, filename="respekt-for-graenser.pdf"
+            ),
+        )
 
-        with smtplib.SMTP(host=context.smtp_server, port=context.smtp_port) as server:
-            server.starttls()
-            server.send_message(msg)
-
-        logger.info("Email sent successfully for form ID: %s", context.form_id)
+        logger.info(
+            "Email sent successfully for form ID: %s "
+            "(attachment %d bytes, estimated attachment memory %d bytes)",
+            context.form_id,
+            attachment_size(context.data),
+            estimate_attachment_memory(context.data),
+        )
 
     except Exception as e:
         logger.error("Error sending email for form ID %s: %s", context.form_id, e)
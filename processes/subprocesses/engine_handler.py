@@ -0,0 +1,66 @@
+"""Module to share pooled SQLAlchemy engines between database handlers."""
+
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING
+from urllib.parse import quote_plus
+
+from helpers import config
+
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
+
+logger = logging.getLogger(__name__)
+
+_engines: dict[str, "Engine"] = {}
+_engines_lock = threading.Lock()
+
+
+def get_connection_string(odbc_connection_string: str) -> str:
+    """Build a SQLAlchemy connection string from an ODBC connection string."""
+    return f"mssql+pyodbc:///?odbc_connect={quote_plus(odbc_connection_string)}"
+
+
+def get_engine(connection_string: str | None = None) -> "Engine":
+    """
+    Return a pooled engine for the connection string, creating it on first use.
+
+    Args:
+        connection_string (str | None): SQLAlchemy connection string. Defaults
+            to the one built from the DBCONNECTIONSTRINGPROD environment variable.
+
+    Returns:
+        Engine: Engine shared by every caller using the same connection string.
+    """
+    if connection_string is None:
+        connection_string = get_connection_string(os.environ["DBCONNECTIONSTRINGPROD"])
+
+    with _engines_lock:
+        engine = _engines.get(connection_string)
+        if engine is None:
+            from sqlalchemy import create_engine  # noqa: PLC0415
+
+            engine = create_engine(
+                connection_string,
+                pool_size=config.DB_POOL_SIZE,
+                max_overflow=config.DB_MAX_OVERFLOW,
+                pool_recycle=config.DB_POOL_RECYCLE,
+                pool_pre_ping=config.DB_POOL_PRE_PING,
+            )
+            _engines[connection_string] = engine
+            logger.info("Created pooled database engine.")
+        return engine
+
+
+def dispose_engines() -> None:
+    """Dispose all pooled engines and close their connections."""
+    with _engines_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+
+    for engine in engines:
+        engine.dispose()
+
+    if engines:
+        logger.info("Disposed %d database engine(s).", len(engines))
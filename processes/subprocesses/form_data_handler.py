@@ -0,0 +1,181 @@
+"""Module to extract attachment urls from OS2Forms submission data."""
+
+import json
+import logging
+import re
+from collections.abc import Callable
+
+from helpers import config
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+FORM_TYPE_ATTACHMENT_KEYS = {
+    "respekt_for_graenser": "re",
+    "respekt_for_graenser_privat": "re",
+    "indmeld_kraenkelser_af_boern": "respekt_for",
+}
+
+AttachmentUrlExtractor = Callable[[str | bytes, str], str]
+
+_decoder = json.JSONDecoder()
+
+# Submissions smaller than this are parsed whole, which is faster than
+# checking where in the document the attachments key is.
+TARGETED_MIN_SIZE = 1024 * 1024
+
+# A JSON string up to its first quote, or a bracket. Strings with escaped
+# quotes are continued with str.find, the single-character class is scanned
+# much faster than one that also stops at backslashes.
+_TOKEN_PATTERN = re.compile(r'"[^"]*"|[{}\[\]]')
+
+
+def extract_with_json(form_data: str | bytes, attachment_key: str) -> str:
+    """Parse the whole submission with the standard library parser."""
+    return json.loads(form_data)["data"]["attachments"][attachment_key]["url"]
+
+
+def extract_with_orjson(form_data: str | bytes, attachment_key: str) -> str:
+    """Parse the whole submission with orjson."""
+    if orjson is None:
+        raise ImportError("orjson is not installed")
+    return orjson.loads(form_data)["data"]["attachments"][attachment_key]["url"]
+
+
+def extract_targeted(form_data: str | bytes, attachment_key: str) -> str:
+    """
+    Decode only the `data.attachments` object of the submission.
+
+    Falls back to a full parse when the submission is smaller than
+    TARGETED_MIN_SIZE, when it contains no or several `attachments` keys, when
+    the key is not `data.attachments`, or when the decoded object lacks the
+    attachment.
+
+    Raises:
+        TypeError: If the form data is not a string, like json.loads.
+    """
+    if isinstance(form_data, bytes | bytearray):
+        form_data = form_data.decode("utf-8")
+    if not isinstance(form_data, str):
+        raise TypeError(
+            "the JSON object must be str, bytes or bytearray, "
+            f"not {type(form_data).__name__}"
+        )
+
+    start = None
+    if len(form_data) >= TARGETED_MIN_SIZE:
+        start = _find_attachments_value(form_data)
+    if start is None:
+        return _full_parse(form_data, attachment_key)
+
+    try:
+        attachments, _ = _decoder.raw_decode(form_data, start)
+        return attachments[attachment_key]["url"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return _full_parse(form_data, attachment_key)
+
+
+def _find_attachments_key(form_data: str, start: int) -> int:
+    """Return the offset of the next unescaped `"attachments"` or -1."""
+    offset = form_data.find('"attachments"', start)
+    while offset > 0 and form_data[offset - 1] == "\\":
+        offset = form_data.find('"attachments"', offset + 1)
+    return offset
+
+
+def _is_escaped(form_data: str, offset: int) -> bool:
+    """Whether the character at offset is escaped by an odd run of backslashes."""
+    backslashes = 0
+    while offset - backslashes > 0 and form_data[offset - backslashes - 1] == "\\":
+        backslashes += 1
+    return backslashes % 2 == 1
+
+
+def _is_data_attachments(form_data: str, offset: int) -> bool:
+    """Whether the key at offset is directly inside the top-level `data` object."""
+    # One [bracket, offset of the last string seen] per open object or array.
+    # The last string in an object before a nested value opens is its key.
+    # Strings are not sliced out, as a value can be megabytes long.
+    stack: list[list] = []
+    position = 0
+    while match := _TOKEN_PATTERN.search(form_data, position, offset):
+        token_start, position = match.span()
+        token = form_data[token_start]
+        if token in "{[":
+            stack.append([token, None])
+        elif token in "}]":
+            if not stack:
+                return False
+            stack.pop()
+        else:
+            while _is_escaped(form_data, position - 1):
+                position = form_data.find('"', position, offset) + 1
+                if not position:
+                    return False
+            if stack:
+                stack[-1][1] = token_start
+    return (
+        [bracket for bracket, _ in stack] == ["{", "{"]
+        and stack[0][1] is not None
+        and form_data.startswith('"data"', stack[0][1])
+    )
+
+
+def _find_attachments_value(form_data: str) -> int | None:
+    """Return the offset of the value of `data.attachments`, if its key is unique."""
+    offset = _find_attachments_key(form_data, 0)
+    if offset == -1 or _find_attachments_key(form_data, offset + 1) != -1:
+        return None
+    if not _is_data_attachments(form_data, offset):
+        return None
+
+    value = offset + len('"attachments"')
+    while value < len(form_data) and form_data[value] in " \t\r\n":
+        value += 1
+    if form_data[value : value + 1] != ":":
+        return None
+    value += 1
+    while value < len(form_data) and form_data[value] in " \t\r\n":
+        value += 1
+    return value
+
+
+def _full_parse(form_data: str | bytes, attachment_key: str) -> str:
+    """Parse the whole submission with the fastest available parser."""
+    if orjson is not None:
+        return extract_with_orjson(form_data, attachment_key)
+    return extract_with_json(form_data, attachment_key)
+
+
+EXTRACTORS: dict[str, AttachmentUrlExtractor] = {
+    "json": extract_with_json,
+    "orjson": extract_with_orjson,
+    "targeted": extract_targeted,
+}
+
+
+def get_attachment_url_extractor(
+    name: str = config.FORM_DATA_PARSER,
+) -> AttachmentUrlExtractor:
+    """
+    Return the attachment url extractor configured by name.
+
+    Args:
+        name (str): One of "json", "orjson", "targeted" or "auto". "auto"
+            uses the targeted extractor, which falls back to orjson when it
+            is installed.
+
+    Returns:
+        AttachmentUrlExtractor: Function taking raw form data and an
+            attachment key and returning the attachment url.
+    """
+    if name == "auto":
+        return extract_targeted
+    if name == "orjson" and orjson is None:
+        logger.warning("orjson is not installed. Falling back to json.")
+        return extract_with_json
+    return EXTRACTORS[name]
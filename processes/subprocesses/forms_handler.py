@@ -1,68 +1,150 @@
 """Module to interact with the journalizing database and fetch forms."""
 
+import json
 import logging
 import os
-from urllib.parse import quote_plus
+from collections.abc import Iterator
+from datetime import UTC, datetime, timedelta
 
 from dotenv import load_dotenv
-from sqlalchemy import bindparam, create_engine, text
+
+from helpers import config
+from helpers.metrics import timed
+from processes.subprocesses.engine_handler import get_connection_string, get_engine
 
 logger = logging.getLogger(__name__)
 
+_pending_watermark: dict[str, str] = {}
+
+
+def load_forms_watermark() -> dict[str, str] | None:
+    """Load the persisted form discovery watermark, if any."""
+    try:
+        with open(config.FORMS_WATERMARK_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning("Ignoring unreadable forms watermark: %s", e)
+        return None
+
+
+def commit_forms_watermark() -> None:
+    """Persist the watermark of the last get_forms call once its forms are queued."""
+    if not _pending_watermark:
+        return
+
+    config.FORMS_WATERMARK_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = config.FORMS_WATERMARK_PATH.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(_pending_watermark, f)
+    tmp_path.replace(config.FORMS_WATERMARK_PATH)
+
+    logger.info("Forms watermark advanced to %s.", _pending_watermark["since"])
+    _pending_watermark.clear()
+
 
-def get_forms() -> list[dict] | None:
-    """Fetch forms with status 'Failed' from the journalizing database."""
+def _is_full_reconcile_due(watermark: dict[str, str] | None) -> bool:
+    """Whether the next discovery must scan the whole view."""
+    if not config.FORMS_INCREMENTAL_DISCOVERY or watermark is None:
+        return True
+    last_full = datetime.fromisoformat(watermark["last_full_reconcile"])
+    interval = timedelta(hours=config.FORMS_FULL_RECONCILE_HOURS)
+    return datetime.now(UTC) - last_full >= interval
+
+
+def get_forms() -> Iterator[dict]:
+    """
+    Stream forms with status 'Failed' from the journalizing database.
+
+    Rows are fetched from a server-side cursor FORMS_FETCH_BATCH_SIZE at a
+    time and yielded one by one. Only forms submitted since the persisted
+    watermark are scanned, except on the first run and every
+    FORMS_FULL_RECONCILE_HOURS when the whole view is reconciled. The new
+    watermark is kept pending until commit_forms_watermark is called.
+    """
     logger.info("Fetching forms with status 'Failed' from the database.")
 
+    from sqlalchemy import bindparam, text  # noqa: PLC0415
+
     try:
         load_dotenv()
         db_conn = os.getenv("DBCONNECTIONSTRINGPROD")
         if not db_conn:
             logger.error("Error getting database connection string.")
-            return None
-        engine = create_engine(f"mssql+pyodbc:///?odbc_connect={quote_plus(db_conn)}")
+            return
+        engine = get_engine(get_connection_string(db_conn))
+
+        watermark = load_forms_watermark()
+        full_reconcile = _is_full_reconcile_due(watermark)
+        since_clause = "" if full_reconcile else "AND form_submitted_date >= :since"
+
         query = text(
-            """
-            SELECT *
+            f"""
+            SELECT form_id, form_type, form_data, form_submitted_date
             FROM [RPA].[journalizing].[view_Journalizing]
             WHERE (
                 status = :status
                 OR (
                     status NOT IN :or_status
-                    AND DATEDIFF(MINUTE, form_submitted_date, GETDATE()) > 30
+                    AND form_submitted_date < :cutoff
                     AND documented_date IS NULL
                 )
             )
+            {since_clause}
             AND form_type in (
                 'respekt_for_graenser',
                 'respekt_for_graenser_privat',
                 'indmeld_kraenkelser_af_boern'
             )
-            ORDER BY form_submitted_date ASC
+            ORDER BY form_submitted_date DESC
             """
         ).bindparams(bindparam("or_status", expanding=True))
 
-        with engine.connect() as connection:
-            result = connection.execute(
-                query,
-                {
-                    "status": "Failed",
-                    "or_status": [
-                        "Successful",
-                        "Failed",
-                        "Manuel",
-                        "Manual",
-                    ],
-                },
-            )
-            rows = result.mappings().all()
+        with (
+            timed("get_forms"),
+            engine.connect().execution_options(
+                yield_per=config.FORMS_FETCH_BATCH_SIZE
+            ) as connection,
+        ):
+            cutoff = connection.execute(
+                text("SELECT DATEADD(MINUTE, -:minutes, GETDATE())"),
+                {"minutes": config.FORMS_MIN_AGE_MINUTES},
+            ).scalar_one()
+
+            params = {
+                "status": "Failed",
+                "or_status": [
+                    "Successful",
+                    "Failed",
+                    "Manuel",
+                    "Manual",
+                ],
+                "cutoff": cutoff,
+            }
+            if not full_reconcile:
+                params["since"] = datetime.fromisoformat(watermark["since"])
 
-        if not rows:
-            return None
+            found = 0
+            for row in connection.execute(query, params).mappings():
+                found += 1
+                yield dict(row)
 
-        logger.info("Found %d forms.", len(rows))
+        last_full_reconcile = (
+            datetime.now(UTC).isoformat()
+            if full_reconcile
+            else watermark["last_full_reconcile"]
+        )
+        _pending_watermark.update(
+            since=cutoff.isoformat(), last_full_reconcile=last_full_reconcile
+        )
 
-        return [dict(row) for row in rows]
+        logger.info(
+            "Ran %s form discovery up to %s.",
+            "full" if full_reconcile else "incremental",
+            cutoff,
+        )
+        logger.info("Found %d forms.", found)
 
     except Exception as e:
         logger.error("Error fetching forms from database: %s", e)
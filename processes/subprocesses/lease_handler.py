@@ -0,0 +1,234 @@
+"""Leases on forms in the journalizing database, for running several nodes."""
+
+import asyncio
+import logging
+from collections.abc import AsyncIterable, AsyncIterator
+
+from helpers import config
+from helpers.circuit_breaker import circuit_breaker
+from helpers.metrics import timed_function
+from processes.subprocesses.engine_handler import get_engine
+
+logger = logging.getLogger(__name__)
+
+QUEUE_STAGE = "queue"
+PROCESS_STAGE = "process"
+
+_LEASES_TABLE = "[RPA].[journalizing].[FormLeases]"
+
+
+class LeaseHeldError(Exception):
+    """Raised when another node holds the lease on a form"""
+
+    def __init__(self, form_id: str, node_id: str):
+        super().__init__(f"Node {node_id} holds the lease on form {form_id}")
+        self.form_id = form_id
+        self.node_id = node_id
+
+
+@circuit_breaker("db")
+@timed_function("claim_leases")
+def claim_forms(form_ids: list[str], stage: str) -> set[str]:
+    """
+    Claim the leases on forms for this node.
+
+    A form can be claimed when it has no lease yet, when its lease has
+    expired or when this node already holds it. Completed leases are never
+    claimed again. Rows locked by another node's claim are skipped. Missing
+    leases are inserted by one statement and the claimable ones taken by a
+    second, so a batch costs two round trips however many forms it holds.
+
+    Args:
+        form_ids (list[str]): The forms to claim.
+        stage (str): QUEUE_STAGE or PROCESS_STAGE.
+
+    Returns:
+        set[str]: The forms this node now holds the lease on.
+    """
+    if not form_ids:
+        return set()
+
+    from sqlalchemy import bindparam, text  # noqa: PLC0415
+
+    form_ids = list(dict.fromkeys(form_ids))
+    values = ", ".join(f"(:form_id_{i})" for i in range(len(form_ids)))
+    insert = text(
+        f"""INSERT INTO {_LEASES_TABLE} (form_id, stage, node_id, leased_until)
+        SELECT ids.form_id, :stage, :node_id, DATEADD(SECOND, -1, SYSUTCDATETIME())
+        FROM (VALUES {values}) AS ids (form_id)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {_LEASES_TABLE} AS leases WITH (UPDLOCK, HOLDLOCK)
+            WHERE leases.form_id = ids.form_id AND leases.stage = :stage
+        )"""
+    )
+    claim = text(
+        f"""UPDATE {_LEASES_TABLE} WITH (ROWLOCK, READPAST)
+        SET node_id = :node_id,
+            leased_until = DATEADD(SECOND, :ttl, SYSUTCDATETIME())
+        OUTPUT inserted.form_id
+        WHERE stage = :stage
+            AND form_id IN :form_ids
+            AND completed_at IS NULL
+            AND (leased_until < SYSUTCDATETIME() OR node_id = :node_id)"""
+    ).bindparams(bindparam("form_ids", expanding=True))
+
+    with get_engine().connect() as connection:
+        connection.execute(
+            insert,
+            {
+                "stage": stage,
+                "node_id": config.NODE_ID,
+                **{f"form_id_{i}": form_id for i, form_id in enumerate(form_ids)},
+            },
+        )
+        claimed = set(
+            connection.execute(
+                claim,
+                {
+                    "stage": stage,
+                    "form_ids": form_ids,
+                    "node_id": config.NODE_ID,
+                    "ttl": config.LEASE_TTL_SECONDS,
+                },
+            ).scalars()
+        )
+        connection.commit()
+
+    logger.info(
+        "Claimed %d of %d %s lease(s) as %s.",
+        len(claimed),
+        len(form_ids),
+        stage,
+        config.NODE_ID,
+    )
+    return claimed
+
+
+def _finish_leases(form_ids: list[str], stage: str, completed: bool) -> None:
+    """Mark this node's leases on forms as completed, or release them."""
+    if not form_ids:
+        return
+
+    from sqlalchemy import bindparam, text  # noqa: PLC0415
+
+    assignment = (
+        "completed_at = SYSUTCDATETIME()"
+        if completed
+        else "leased_until = DATEADD(SECOND, -1, SYSUTCDATETIME())"
+    )
+    query = text(
+        f"""UPDATE {_LEASES_TABLE}
+        SET {assignment}
+        WHERE stage = :stage AND form_id IN :form_ids AND node_id = :node_id"""
+    ).bindparams(bindparam("form_ids", expanding=True))
+
+    with get_engine().connect() as connection:
+        for start in range(0, len(form_ids), config.LEASE_BATCH_SIZE):
+            connection.execute(
+                query,
+                {
+                    "stage": stage,
+                    "form_ids": form_ids[start : start + config.LEASE_BATCH_SIZE],
+                    "node_id": config.NODE_ID,
+                },
+            )
+        connection.commit()
+
+
+@circuit_breaker("db")
+@timed_function("complete_leases")
+def complete_forms(form_ids: list[str], stage: str) -> None:
+    """Mark the leases this node holds on forms as completed for good."""
+    _finish_leases(form_ids, stage, completed=True)
+
+
+@circuit_breaker("db")
+@timed_function("release_leases")
+def release_forms(form_ids: list[str], stage: str) -> None:
+    """Release the leases this node holds on forms so any node can claim them."""
+    _finish_leases(form_ids, stage, completed=False)
+
+
+@circuit_breaker("db")
+def get_lease(form_id: str, stage: str) -> dict | None:
+    """Return the holder of the lease on a form and whether it is completed."""
+    from sqlalchemy import text  # noqa: PLC0415
+
+    query = text(
+        f"""SELECT node_id, completed_at FROM {_LEASES_TABLE}
+        WHERE form_id = :form_id AND stage = :stage"""
+    )
+    with get_engine().connect() as connection:
+        row = connection.execute(
+            query, {"form_id": form_id, "stage": stage}
+        ).one_or_none()
+
+    if row is None:
+        return None
+    return {"node_id": row.node_id, "completed": row.completed_at is not None}
+
+
+def acquire_form_lease(form_id: str, stage: str) -> bool:
+    """
+    Claim the lease on one form when leases are enabled.
+
+    Returns:
+        bool: Whether a node has already completed the stage for the form.
+
+    Raises:
+        LeaseHeldError: If another node holds the lease.
+    """
+    if not config.LEASES_ENABLED or claim_forms([form_id], stage):
+        return False
+
+    lease = get_lease(form_id, stage) or {"node_id": "unknown", "completed": False}
+    if lease["completed"]:
+        return True
+    raise LeaseHeldError(form_id, lease["node_id"])
+
+
+def finish_form_leases(form_ids: list[str], stage: str, succeeded: bool) -> None:
+    """
+    Complete the leases on forms after success, release them otherwise.
+
+    Failures are only logged, as unfinished leases expire after LEASE_TTL_SECONDS.
+    """
+    if not config.LEASES_ENABLED:
+        return
+
+    try:
+        if succeeded:
+            complete_forms(form_ids, stage)
+        else:
+            release_forms(form_ids, stage)
+    except Exception as e:
+        logger.warning("Could not finish %d %s lease(s): %s", len(form_ids), stage, e)
+
+
+async def leased_items(items: AsyncIterable[dict], stage: str) -> AsyncIterator[dict]:
+    """
+    Yield the items whose form this node claims, claiming LEASE_BATCH_SIZE at a time.
+
+    Args:
+        items (AsyncIterable[dict]): Queue items with a form ID as reference.
+        stage (str): QUEUE_STAGE or PROCESS_STAGE.
+    """
+    batch: list[dict] = []
+
+    async def claim(batch: list[dict]) -> list[dict]:
+        references = [str(item.get("reference") or "") for item in batch]
+        claimed = await asyncio.to_thread(claim_forms, references, stage)
+        for reference in set(references) - claimed:
+            logger.info("Form %s is leased by another node. Not added.", reference)
+        return [item for item in batch if str(item.get("reference") or "") in claimed]
+
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= config.LEASE_BATCH_SIZE:
+            for claimed_item in await claim(batch):
+                yield claimed_item
+            batch = []
+
+    if batch:
+        for claimed_item in await claim(batch):
+            yield claimed_item
@@ -0,0 +1,186 @@
+"""Module to prefetch attachments for upcoming work items in the background."""
+
+import logging
+import queue
+import threading
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from automation_server_client import WorkItem
+
+from helpers import ats_functions, config
+from helpers.send_ledger import get_send_ledger
+from processes.subprocesses.credentials_constant_handler import get_credentials
+from processes.subprocesses.email_handler import attachment_size, get_attachment
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+@dataclass
+class PrefetchedItem:
+    """A work item together with its prefetched attachment, if any"""
+
+    item: WorkItem
+    attachment: BinaryIO | None = None
+
+
+class AttachmentPrefetcher:
+    """
+    Thread-safe iterator of work items that downloads attachments ahead of use.
+
+    Up to `depth` items are claimed from the workqueue ahead of the consumer
+    and their attachments are kept, spooled to disk when large, within
+    `max_bytes`. With a depth of 0 items are handed out directly without any
+    background downloads. Items still prefetched when processing stops are
+    returned by stop() so the caller can process them.
+    """
+
+    def __init__(
+        self,
+        items: Iterator[WorkItem],
+        depth: int = config.PREFETCH_DEPTH,
+        max_bytes: int = config.PREFETCH_MAX_BYTES,
+    ):
+        self._items = items
+        self._depth = depth
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._budget = threading.Condition()
+        self._used_bytes = 0
+        self._stopped = threading.Event()
+        self._exhausted = False
+        self._queue: queue.Queue = queue.Queue(maxsize=max(depth, 1))
+        self._unplaced: list[PrefetchedItem] = []
+        self._thread: threading.Thread | None = None
+
+        if depth > 0:
+            self._thread = threading.Thread(
+                target=self._produce, name="attachment-prefetch", daemon=True
+            )
+            self._thread.start()
+
+    def __iter__(self) -> "AttachmentPrefetcher":
+        return self
+
+    def __next__(self) -> PrefetchedItem:
+        if self._thread is None:
+            with self._lock:
+                item = None if self._stopped.is_set() else next(self._items, None)
+            if item is None:
+                raise StopIteration
+            return PrefetchedItem(item=item)
+
+        with self._lock:
+            if self._exhausted:
+                raise StopIteration
+            entry = self._queue.get()
+            if entry is _DONE:
+                self._exhausted = True
+                raise StopIteration
+            return entry
+
+    def _produce(self) -> None:
+        """Claim items and download their attachments until stopped."""
+        try:
+            while not self._stopped.is_set():
+                with self._budget:
+                    while (
+                        0 < self._max_bytes <= self._used_bytes
+                        and not self._stopped.is_set()
+                    ):
+                        self._budget.wait(timeout=1)
+
+                if self._stopped.is_set():
+                    break
+
+                item = next(self._items, None)
+                if item is None:
+                    break
+
+                entry = PrefetchedItem(item=item, attachment=self._download(item))
+                if entry.attachment is not None:
+                    with self._budget:
+                        self._used_bytes += attachment_size(entry.attachment)
+
+                self._put(entry)
+        except Exception as e:
+            logger.error("Attachment prefetching stopped: %s", e)
+        finally:
+            self._put(_DONE, force=True)
+
+    def _put(self, entry: object, force: bool = False) -> None:
+        """Put an entry on the queue, giving up when stopped unless forced."""
+        while True:
+            try:
+                self._queue.put(entry, timeout=1)
+                return
+            except queue.Full:
+                if self._stopped.is_set() and not force:
+                    if isinstance(entry, PrefetchedItem):
+                        self._unplaced.append(entry)
+                    return
+
+    @staticmethod
+    def _download(item: WorkItem) -> BinaryIO | None:
+        """Download the attachment of an item, leaving failures to the consumer."""
+        data, reference = ats_functions.get_item_info(item)
+        if get_send_ledger().get(reference, data.get("attachment_url", "")):
+            return None
+        try:
+            return get_attachment(
+                url=data.get("attachment_url", ""),
+                api_key=get_credentials("os2_api")["decrypted_password"],
+            )
+        except Exception as e:
+            logger.warning(
+                "Prefetching attachment for %s failed, retrying on use: %s",
+                reference,
+                e,
+            )
+            return None
+
+    def release(self, entry: PrefetchedItem) -> None:
+        """Close a processed item's attachment and release its share of the budget."""
+        if entry.attachment is None:
+            return
+        with self._budget:
+            self._used_bytes -= attachment_size(entry.attachment)
+            self._budget.notify_all()
+        entry.attachment.close()
+        entry.attachment = None
+
+    def stop(self) -> list[PrefetchedItem]:
+        """
+        Stop prefetching.
+
+        Returns:
+            list[PrefetchedItem]: The items claimed ahead but not handed out,
+                with their attachments, in workqueue order.
+        """
+        self._stopped.set()
+        with self._budget:
+            self._budget.notify_all()
+
+        if self._thread is None:
+            return []
+
+        leftovers = []
+        while not self._exhausted:
+            try:
+                entry = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self._thread.is_alive():
+                    break
+                continue
+            if entry is _DONE:
+                self._exhausted = True
+                break
+            leftovers.append(entry)
+
+        self._thread.join()
+        leftovers += self._unplaced
+        self._unplaced = []
+        return leftovers
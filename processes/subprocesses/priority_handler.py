@@ -0,0 +1,60 @@
+"""
+Module to tag work items with a priority when they are queued.
+
+Forms are queued newest first and ATS hands items out in queue order, as it
+has no priority-aware claim. The priority is the class under which the time
+an item waited in the queue is recorded.
+"""
+
+import logging
+from datetime import UTC, datetime, timedelta
+
+from automation_server_client import WorkItem
+
+from helpers import ats_functions, config, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def assign_priority(
+    form_type: str | None, submitted: datetime | str | None, now: datetime | None = None
+) -> int:
+    """
+    Return the priority of a form, higher is processed first.
+
+    The priority of the form type is raised by PRIORITY_RECENT_BOOST for forms
+    submitted within the last PRIORITY_RECENT_HOURS.
+
+    Args:
+        form_type (str | None): The type of the form.
+        submitted (datetime | str | None): When the form was submitted.
+        now (datetime | None): The current time, defaults to now.
+
+    Returns:
+        int: The priority class of the form.
+    """
+    priority = config.FORM_TYPE_PRIORITIES.get(form_type, config.PRIORITY_DEFAULT)
+
+    if isinstance(submitted, str):
+        submitted = datetime.fromisoformat(submitted)
+    if submitted is None:
+        return priority
+
+    now = now or datetime.now(UTC)
+    if submitted.tzinfo is None:
+        # The journalizing database stores local time.
+        now = now.astimezone().replace(tzinfo=None)
+    if now - submitted < timedelta(hours=config.PRIORITY_RECENT_HOURS):
+        priority += config.PRIORITY_RECENT_BOOST
+    return priority
+
+
+def record_queue_wait(item: WorkItem) -> None:
+    """Record the time an item waited since it was queued under its priority class."""
+    data, _ = ats_functions.get_item_info(item)
+    queued_at = data.get("queued_at")
+    if not queued_at:
+        return
+    priority = int(data.get("priority", config.PRIORITY_DEFAULT))
+    waited = datetime.now(UTC) - datetime.fromisoformat(queued_at)
+    metrics.record(f"queue_wait_p{priority}", max(waited.total_seconds(), 0.0))
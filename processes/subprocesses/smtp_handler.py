@@ -0,0 +1,356 @@
+"""Module to keep pools of SMTP sessions open and reuse them across messages."""
+
+import base64
+import io
+import logging
+import re
+import secrets
+import socket
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.generator import BytesGenerator
+from email.message import EmailMessage
+from email.utils import getaddresses
+from typing import TYPE_CHECKING, BinaryIO
+
+from helpers import config
+
+if TYPE_CHECKING:
+    import smtplib
+
+logger = logging.getLogger(__name__)
+
+# Raw bytes per base64 line, and the length of the line with its CRLF.
+_BASE64_LINE_BYTES = 57
+_BASE64_LINE_CHARS = 78
+
+
+@dataclass
+class StreamedAttachment:
+    """An attachment that is base64-encoded while the message is being sent"""
+
+    file: BinaryIO
+    filename: str
+    maintype: str = "application"
+    subtype: str = "octet-stream"
+
+
+def frame_attachment(
+    msg: EmailMessage, attachment: StreamedAttachment
+) -> tuple[bytes, bytes]:
+    """
+    Add a placeholder attachment to a message and serialize it around it.
+
+    Args:
+        msg (EmailMessage): The message, which gets the placeholder attachment.
+        attachment (StreamedAttachment): The attachment the placeholder stands in for.
+
+    Returns:
+        tuple[bytes, bytes]: The dot-stuffed SMTP data before and after the
+            base64 body of the attachment.
+    """
+    placeholder = secrets.token_bytes(48)
+    msg.add_attachment(
+        placeholder,
+        maintype=attachment.maintype,
+        subtype=attachment.subtype,
+        filename=attachment.filename,
+    )
+
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=msg.policy.clone(linesep="\r\n")).flatten(msg)
+    head, tail = buffer.getvalue().split(base64.b64encode(placeholder) + b"\r\n", 1)
+    if not tail.endswith(b"\r\n"):
+        tail += b"\r\n"
+    return re.sub(rb"(?m)^\.", b"..", head), re.sub(rb"(?m)^\.", b"..", tail)
+
+
+def _chunk_size() -> int:
+    """Return the encoding chunk size, rounded down to whole base64 lines."""
+    return max(
+        config.ATTACHMENT_CHUNK_BYTES // _BASE64_LINE_BYTES * _BASE64_LINE_BYTES,
+        _BASE64_LINE_BYTES,
+    )
+
+
+def encoding_buffer_size(size: int) -> int:
+    """Return the bytes buffered while encoding an attachment of a given size."""
+    chunk = min(size, _chunk_size())
+    lines = -(-chunk // _BASE64_LINE_BYTES)
+    return chunk + lines * _BASE64_LINE_CHARS
+
+
+def encode_attachment(file: BinaryIO) -> Iterator[bytes]:
+    """Yield the base64 body of an attachment in CRLF-terminated lines, chunk by chunk."""
+    chunk_size = _chunk_size()
+    file.seek(0)
+    while chunk := file.read(chunk_size):
+        yield base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+
+
+def _send_streamed(
+    smtp: "smtplib.SMTP",
+    msg: EmailMessage,
+    framing: tuple[bytes, bytes],
+    attachment: StreamedAttachment,
+) -> None:
+    """Send a framed message, writing the attachment straight to the socket."""
+    import smtplib  # noqa: PLC0415
+
+    from_addr = msg["From"]
+    to_addrs = [
+        address
+        for _, address in getaddresses(msg.get_all("To", []) + msg.get_all("Cc", []))
+    ]
+
+    smtp.ehlo_or_helo_if_needed()
+    code, response = smtp.mail(from_addr)
+    if code != 250:  # noqa: PLR2004
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(code, response, from_addr)
+
+    refused = {}
+    for address in to_addrs:
+        code, response = smtp.rcpt(address)
+        if code not in (250, 251):
+            refused[address] = (code, response)
+    if len(refused) == len(to_addrs):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, response = smtp.docmd("data")
+    if code != 354:  # noqa: PLR2004
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    head, tail = framing
+    chunks = encode_attachment(attachment.file)
+    pending = head + next(chunks, b"")
+    for lines in chunks:
+        smtp.send(pending)
+        pending = lines
+    smtp.send(pending + tail + b".\r\n")
+
+    code, response = smtp.getreply()
+    if code != 250:  # noqa: PLR2004
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+
+def check_smtp_server(host: str, port: int) -> None:
+    """Connect to a server and send NOOP to see whether it accepts sessions."""
+    import smtplib  # noqa: PLC0415
+
+    with smtplib.SMTP(host, port, timeout=config.SMTP_TIMEOUT) as smtp:
+        code, response = smtp.noop()
+        if code != 250:  # noqa: PLR2004
+            raise smtplib.SMTPResponseException(code, response)
+
+
+class SMTPSession:
+    """A reusable SMTP session that reconnects when needed."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._smtp: smtplib.SMTP | None = None
+        self._messages_sent = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> "smtplib.SMTP":
+        """Open a new connection, upgrading it with STARTTLS if configured."""
+        import smtplib  # noqa: PLC0415
+
+        logger.info("Opening SMTP session to %s:%s", self.host, self.port)
+        smtp = smtplib.SMTP(self.host, self.port, timeout=config.SMTP_TIMEOUT)
+        # Streamed messages are written in chunks, which Nagle's algorithm
+        # would otherwise hold back until the server acknowledges the last one.
+        smtp.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if config.SMTP_STARTTLS:
+            smtp.starttls()
+        self._messages_sent = 0
+        return smtp
+
+    def _disconnect(self) -> None:
+        """Close the current connection, ignoring errors from a dead socket."""
+        if self._smtp is None:
+            return
+
+        import smtplib  # noqa: PLC0415
+
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+    def send_message(
+        self, msg: EmailMessage, attachment: StreamedAttachment | None = None
+    ) -> None:
+        """
+        Send a message on the session, reconnecting once if the server hung up.
+
+        Args:
+            msg (EmailMessage): The message to send.
+            attachment (StreamedAttachment | None): An attachment to stream into
+                the message instead of holding it encoded in memory.
+        """
+        import smtplib  # noqa: PLC0415
+
+        framing = None if attachment is None else frame_attachment(msg, attachment)
+
+        with self._lock:
+            if self._messages_sent >= config.SMTP_MAX_MESSAGES_PER_SESSION:
+                self._disconnect()
+
+            for attempt in range(2):
+                if self._smtp is None:
+                    self._smtp = self._connect()
+                try:
+                    if framing is None:
+                        self._smtp.send_message(msg)
+                    else:
+                        _send_streamed(self._smtp, msg, framing, attachment)
+                    self._messages_sent += 1
+                    return
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    self._smtp.close()
+                    self._smtp = None
+                    if attempt:
+                        raise
+                    logger.warning(
+                        "SMTP session to %s:%s was disconnected. Reconnecting...",
+                        self.host,
+                        self.port,
+                    )
+                except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                    # The server refused the message and the session was reset.
+                    raise
+                except BaseException:
+                    # Anything else can leave the connection inside DATA, where
+                    # the next message's MAIL FROM would end up in this body.
+                    self._smtp.close()
+                    self._smtp = None
+                    raise
+
+    def close(self) -> None:
+        """Close the session."""
+        with self._lock:
+            self._disconnect()
+
+
+class SMTPPool:
+    """
+    Pool of up to `size` reusable SMTP sessions to one server.
+
+    Every concurrent sender takes a session of its own, so sends to the same
+    server run in parallel. Sessions are opened on demand and kept for reuse,
+    each reconnecting after SMTP_MAX_MESSAGES_PER_SESSION messages.
+    """
+
+    def __init__(self, host: str, port: int, size: int):
+        self.host = host
+        self.port = port
+        self.size = max(size, 1)
+        self._idle: list[SMTPSession] = []
+        self._open = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def session(self) -> Iterator[SMTPSession]:
+        """Borrow a session, waiting while all `size` sessions are in use."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._idle or self._open < self.size)
+            if self._idle:
+                session = self._idle.pop()
+            else:
+                session = SMTPSession(self.host, self.port)
+                self._open += 1
+
+        try:
+            yield session
+        finally:
+            with self._condition:
+                surplus = self._closed or self._open > self.size
+                if surplus:
+                    self._open -= 1
+                else:
+                    self._idle.append(session)
+                self._condition.notify()
+            if surplus:
+                session.close()
+
+    def send_message(
+        self, msg: EmailMessage, attachment: StreamedAttachment | None = None
+    ) -> None:
+        """Send a message on a session of the pool."""
+        with self.session() as session:
+            session.send_message(msg, attachment=attachment)
+
+    def resize(self, size: int) -> None:
+        """Change the number of sessions, closing surplus ones as they are returned."""
+        with self._condition:
+            self.size = max(size, 1)
+            while self._idle and self._open > self.size:
+                self._idle.pop().close()
+                self._open -= 1
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """Close the idle sessions, and the others once they are returned."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+
+        for session in idle:
+            session.close()
+
+
+_pools: dict[tuple[str, int], SMTPPool] = {}
+_pools_lock = threading.Lock()
+_pool_size = 1
+
+
+def set_smtp_pool_size(size: int) -> None:
+    """Set the number of sessions per server, normally the number of senders."""
+    global _pool_size  # noqa: PLW0603
+
+    with _pools_lock:
+        _pool_size = max(size, 1)
+        pools = list(_pools.values())
+
+    for pool in pools:
+        pool.resize(size)
+
+
+def get_smtp_pool(host: str, port: int) -> SMTPPool:
+    """Return the shared session pool for a server, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get((host, port))
+        if pool is None:
+            pool = _pools[(host, port)] = SMTPPool(host, port, _pool_size)
+        return pool
+
+
+def send_smtp_message(
+    host: str,
+    port: int,
+    msg: EmailMessage,
+    attachment: StreamedAttachment | None = None,
+) -> None:
+    """Send a message through the shared session pool for the server."""
+    get_smtp_pool(host, int(port)).send_message(msg, attachment=attachment)
+
+
+def close_smtp_sessions() -> None:
+    """Close all shared SMTP session pools."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,20 @@
+-- Leases on forms, claimed by each node before it queues or processes a form.
+-- Required when LEASES_ENABLED is set in helpers/config.py.
+--
+-- A node claims a lease by setting node_id and leased_until. A lease whose
+-- leased_until has passed can be claimed by any node, so the forms of a
+-- crashed node are picked up again after LEASE_TTL_SECONDS. completed_at is set
+-- once the stage is done for the form, after which it is never claimed again.
+
+CREATE TABLE [RPA].[journalizing].[FormLeases] (
+    form_id NVARCHAR(255) NOT NULL,
+    stage NVARCHAR(20) NOT NULL,  -- 'queue' or 'process'
+    node_id NVARCHAR(255) NOT NULL,
+    leased_until DATETIME2 NOT NULL,
+    completed_at DATETIME2 NULL,
+    CONSTRAINT PK_FormLeases PRIMARY KEY (form_id, stage)
+);
+
+CREATE INDEX IX_FormLeases_claimable
+    ON [RPA].[journalizing].[FormLeases] (stage, leased_until)
+    WHERE completed_at IS NULL;